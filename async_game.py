@@ -0,0 +1,255 @@
+import time
+import asyncio
+import itertools
+from coze_client import AsyncCozeClient
+from game import WhoIsUndercoverGame, VoteTally, DEADLINE_GRACE
+
+
+# 基于 asyncio 的游戏逻辑类
+class AsyncWhoIsUndercoverGame(WhoIsUndercoverGame):
+    """WhoIsUndercoverGame 的 asyncio 版本
+
+    游戏规则、日志和信号与同步版本共用，每个环节都同时向所有存活玩家发出请求，
+    所有对话在同一个事件循环中等待，不再为每次操作新建线程。
+    """
+
+    def __init__(self, agents, game_themes, client=None, concurrency=None, signals=None, config=None, budgets=None,
+                 max_workers=16):
+        super().__init__(agents, game_themes, client, concurrency, signals, config, budgets)
+        self.async_client = AsyncCozeClient(self.client, max_workers=max_workers)
+
+    async def send_message_to_agent(self, agent_key, message, wait_ack=True, phase=None, stateless=False):
+        """向指定智能体发送消息并获取回复，phase 指定使用哪个环节的时间预算，stateless 时发到新会话"""
+        agent = self.agents[agent_key]
+        if wait_ack:
+            await self.wait_for_ack(agent_key)
+        route = self.route(agent_key, message, phase, stateless)
+        if route is None:
+            return self.local_reply(agent_key, phase)
+        bot_id, message, options = route
+        self.update_player_status(agent_key, "thinking")
+        request = self.begin_request(agent_key, phase)
+
+        # 流式输出时把已生成的部分内容实时推送到界面
+        def on_delta(partial):
+            if not self.is_cut_off(request):
+                self.update_player_status(agent_key, "thinking", partial)
+
+        try:
+            self.log(f"正在向 {agent['name']} 发送请求...")
+            answer = await self.chat_with_retry(agent_key, bot_id, message, phase, options, on_delta, request)
+        except Exception as e:
+            # 结果已确定后被主动取消的请求不计入熔断器
+            if self.is_cut_off(request):
+                return None
+            self.record_outcome(agent_key, bot_id, False)
+            return self.handle_reply(agent_key, error=e, phase=phase)
+        finally:
+            self.finish_request(request)
+        # 被截止的请求不计入熔断器，也不再更新玩家状态(出局玩家的卡片保持已淘汰)
+        if self.is_cut_off(request):
+            return answer
+        self.record_outcome(agent_key, bot_id, bool(answer))
+        return self.handle_reply(agent_key, answer)
+
+    async def chat_with_retry(self, agent_key, bot_id, message, phase, options, on_delta, request):
+        """发起对话，可重试的错误在本次请求的截止时间内退避后重试"""
+        deadline = self.deadline_for(phase)
+        for attempt in itertools.count(1):
+            try:
+                return await self.hedged_chat(agent_key, bot_id, message, phase, deadline,
+                                              self.attempt_options(agent_key, bot_id, options, request), on_delta,
+                                              request)
+            except Exception as e:
+                delay = self.retry_policy.next_delay(e, attempt, deadline)
+                if delay is None or self.is_cut_off(request):
+                    raise
+                self.record_retry(agent_key, e, delay)
+                self.abandon_chats(request)
+                await asyncio.sleep(delay)
+
+    async def hedged_chat(self, agent_key, bot_id, message, phase, deadline, options, on_delta, request):
+        """与同步版本相同：超过该 bot 近期耗时的高分位仍未完成时发出对冲请求，取先完成的结果"""
+        user_id = self.agents[agent_key]["user_id"]
+        delay = self.hedge_delay(bot_id, phase, deadline)
+        winner = []
+        chats = {}
+
+        async def attempt(name, message, conversation_id=None, on_created=None, on_delta=None):
+            created, partial = self.hedge_callbacks(name, winner, chats, on_created, on_delta)
+            start = time.monotonic()
+            answer = await self.async_client.chat(bot_id, user_id, message, on_delta=partial,
+                                                  conversation_id=conversation_id, on_created=created,
+                                                  multiplex=self.concurrency["multiplex"], deadline=deadline)
+            self.record_latency(bot_id, time.monotonic() - start)
+            return answer
+
+        if delay is None:
+            return await attempt("primary", message, on_delta=on_delta, **options)
+
+        with self.stats_lock:
+            self.hedge_stats["eligible"] += 1
+        primary = asyncio.ensure_future(attempt("primary", message, on_delta=on_delta, **options))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.allow_hedge():
+            return await primary
+
+        self.log(f"{self.agents[agent_key]['name']} 超过 {delay:.1f} 秒未完成，发出对冲请求")
+        hedge = asyncio.ensure_future(attempt("hedge", self.hedge_message(agent_key, message, phase),
+                                              on_created=self.track_chat(request)))
+        names = {primary: "primary", hedge: "hedge"}
+        pending = {primary, hedge}
+        error = None
+        answer = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                answer = task.result()
+                if answer:
+                    self.finish_hedge(names[task], winner, chats)
+                    for loser in pending:
+                        loser.cancel()
+                    return answer
+        if error is not None and not answer:
+            raise error
+        return answer
+
+    async def wait_for_ack(self, agent_key):
+        """等待该玩家在后台进行的词语确认请求结束"""
+        task = self.pending_acks.pop(agent_key, None)
+        if task is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.budgets["init"] + DEADLINE_GRACE)
+        except asyncio.TimeoutError:
+            self.log(f"{self.agents[agent_key]['name']} 确认词语超时")
+
+    async def acknowledge_word(self, player, message):
+        """后台发送词语并记录确认结果"""
+        response = await self.send_message_to_agent(player, message, wait_ack=False, phase="init")
+        self.log_acknowledgement(player, response)
+        return response
+
+    async def ask_players(self, players, messages, phase, stateless=False, until=None):
+        """同时向多个玩家发送消息，按座次返回 {玩家: 回复}，超过该环节时间预算的玩家记为 None
+
+        until(玩家, 回复) 按回复到达的顺序调用，返回 True 时取消其余玩家的请求，他们不出现在结果中。
+        """
+        timeout = self.budgets[phase]
+
+        async def ask(player):
+            try:
+                return await asyncio.wait_for(self.send_message_to_agent(player, messages[player], phase=phase,
+                                                                          stateless=stateless),
+                                              timeout + DEADLINE_GRACE)
+            except asyncio.TimeoutError:
+                self.log(f"{self.agents[player]['name']} 超过 {timeout} 秒未回复")
+                self.record_timeout(player, phase)
+                return None
+
+        tasks = {asyncio.ensure_future(ask(player)): player for player in self.dispatch_order(players)}
+        pending = set(tasks)
+        replies = {}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            stop = False
+            for task in done:
+                player = tasks[task]
+                replies[player] = task.result()
+                stop = stop or (until is not None and until(player, replies[player]))
+            if stop and pending:
+                self.cut_off([tasks[task] for task in pending], phase)
+                for task in pending:
+                    task.cancel()
+                break
+        return {player: replies[player] for player in players if player in replies}
+
+    async def initialize_game(self):
+        """初始化游戏，同时向所有玩家分配词语"""
+        self.start_new_game()
+        init_mode = self.game_config["init_mode"]
+        if init_mode == "skip":
+            self.finish_initialization(None)
+            return
+
+        messages = self.word_messages()
+        if init_mode == "async":
+            for player in self.players_alive:
+                self.pending_acks[player] = asyncio.ensure_future(self.acknowledge_word(player, messages[player]))
+            self.finish_initialization(None)
+            return
+
+        responses = await self.ask_players(self.players_alive, messages, "init")
+        self.finish_initialization(responses)
+
+    async def play_round(self):
+        """进行一轮游戏"""
+        self.start_round()
+
+        round_responses = {}
+        # 流水线模式下上一轮结束时已经发出了本轮的描述请求
+        descriptions = await self.take_prefetched()
+        if descriptions is None:
+            descriptions = await self.ask_players(self.players_alive, self.description_messages(), "description")
+        for player in self.players_alive:
+            self.record_description(round_responses, player, descriptions[player])
+        self.complete_descriptions(round_responses)
+
+        # 推测模式下投票期间就发出下一轮的描述请求，本轮之后游戏必定结束时不发
+        if self.game_config["speculative_descriptions"] and not self.final_round():
+            self.prefetch_descriptions(stateless=True)
+        votes = await self.conduct_voting()
+        self.process_votes(votes)
+        game_over = self.check_game_over()
+        self.finish_round(game_over)
+        return game_over
+
+    def prefetch_descriptions(self, stateless=False):
+        """在事件循环中提前发出下一轮的描述请求，stateless 时发到新会话"""
+        messages = self.speculative_messages() if stateless else self.description_messages()
+        self.prefetched = asyncio.ensure_future(
+            self.ask_players(list(self.players_alive), messages, "description", stateless))
+
+    async def take_prefetched(self):
+        """取出提前发出的描述请求的结果，只保留仍存活的玩家，没有时返回 None"""
+        task, self.prefetched = self.prefetched, None
+        if task is None:
+            return None
+        descriptions = await task
+        return {player: descriptions.get(player) for player in self.players_alive}
+
+    async def conduct_voting(self):
+        """进行投票"""
+        self.update_status("投票中...")
+        vote_info = self.vote_prompt()
+        messages = {player: vote_info for player in self.players_alive}
+        tally = VoteTally(self.players_alive)
+        votes = {}
+
+        # 按到达顺序计票，淘汰结果确定后不再等待其余投票
+        def count(player, vote_text):
+            votes[player] = self.parse_vote(player, vote_text)
+            tally.add(votes[player])
+            return self.game_config["vote_cutoff"] and tally.decided() is not None
+
+        replies = await self.ask_players(self.players_alive, messages, "vote", until=count)
+        for player, vote_text in replies.items():
+            if player not in votes:
+                count(player, vote_text)
+        self.log_skipped_votes(votes)
+        return votes
+
+    async def run_game(self):
+        """运行完整游戏"""
+        await self.initialize_game()
+
+        game_over = False
+        while not game_over:
+            game_over = await self.play_round()
+            if not game_over and self.round_pause:
+                await asyncio.sleep(self.round_pause)  # 暂停几秒，便于阅读
+
+        return self.game_result()
@@ -0,0 +1,265 @@
+"""端到端性能测试：统计每个环节的耗时分位数、每小时局数、每局 HTTP 请求数和 CPU 时间
+
+运行: python -m benchmark --games 20 --latency lognormal:1.5:0.4 --output bench.json
+对比: python -m benchmark --games 20 --compare bench.json
+"""
+import io
+import json
+import math
+import time
+import random
+import argparse
+import functools
+import threading
+from urllib.parse import urlparse, parse_qs
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from coze_client import CozeClient, RateLimiter
+from game import AGENTS, GAME_THEMES, WhoIsUndercoverGame
+from mock_server import MockCozeState, parse_latency
+from providers import with_provider
+
+# 统计耗时的游戏环节
+PHASES = ["initialize_game", "play_round", "conduct_voting", "process_votes"]
+
+
+class FakeCozeTransport(BaseAdapter):
+    """进程内的假传输层
+
+    复用 mock_server 的对话状态生成响应，不经过网络；每个请求先按配置等待一次
+    网络往返时间，对话本身的完成耗时由 MockCozeState 的耗时分布决定。
+    """
+
+    def __init__(self, state, rtt="fixed:0.02"):
+        super().__init__()
+        self.state = state
+        self.rtt = parse_latency(rtt)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.rtt())
+        url = urlparse(request.url)
+        query = parse_qs(url.query)
+        self.state.count(url.path)
+
+        if request.method == "POST" and url.path == "/v3/chat/cancel":
+            payload = json.loads(request.body or b"{}")
+            chat = self.state.chats.get(payload.get("chat_id", ""))
+            if chat is None:
+                return self.build(request, {"code": 4200, "msg": "chat not found"})
+            return self.build(request, {"code": 0, "msg": "", "data": self.state.cancel(chat)})
+
+        if request.method == "POST" and url.path == "/v3/chat":
+            payload = json.loads(request.body or b"{}")
+            chat = self.state.create_chat(payload, query.get("conversation_id", [None])[0])
+            if not payload.get("stream"):
+                return self.build(request, {"code": 0, "msg": "", "data": self.state.chat_data(chat)})
+            # 流式对话：等到对话完成后一次性返回全部事件
+            time.sleep(max(chat["ready_at"] - time.time(), 0))
+            body = "".join(
+                f"event:{event}\ndata:{data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)}\n\n"
+                for event, data in self.state.stream_events(chat)
+            )
+            return self.build(request, body, "text/event-stream")
+
+        chat = self.state.chats.get(query.get("chat_id", [""])[0])
+        if chat is None:
+            return self.build(request, {"code": 4200, "msg": "chat not found"})
+        if url.path == "/v3/chat/retrieve":
+            return self.build(request, {"code": 0, "msg": "", "data": self.state.chat_data(chat)})
+        if url.path == "/v3/chat/message/list":
+            return self.build(request, {"code": 0, "msg": "", "data": self.state.messages(chat)})
+        return self.build(request, {"code": 4004, "msg": "not found"}, status=404)
+
+    def build(self, request, body, content_type="application/json", status=200):
+        """构造 requests 的响应对象"""
+        if not isinstance(body, str):
+            body = json.dumps(body, ensure_ascii=False)
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({"Content-Type": content_type})
+        response.raw = io.BytesIO(body.encode("utf-8"))
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def percentile(values, q):
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def summarize(values):
+    """耗时列表的汇总统计"""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0)
+    }
+
+
+def instrument(game, timings):
+    """替换游戏对象上各环节的方法，记录每次调用的耗时"""
+    for phase in PHASES:
+        method = getattr(game, phase)
+
+        @functools.wraps(method)
+        def timed(*args, _method=method, _phase=phase, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                timings[_phase].append(time.perf_counter() - start)
+
+        setattr(game, phase, timed)
+
+
+def make_game(transport, stream, concurrency=None, hedge=False, speculative=False, provider="coze", vote_cutoff=False):
+    """创建使用假传输层的游戏对象；provider 为 scripted 或 embedding 时所有智能体在进程内回答，只测量引擎自身的开销"""
+    if provider != "coze":
+        game = WhoIsUndercoverGame(with_provider(AGENTS, provider), GAME_THEMES, concurrency=concurrency)
+    else:
+        # 假传输层没有配额，使用独立的不限速限流器，测量的是引擎本身而不是限流等待
+        client = CozeClient("benchmark", pool_size=len(AGENTS), stream=stream, base_url="http://coze.benchmark",
+                            rate_limiter=RateLimiter({"rate": None}))
+        client.session.mount("http://", transport)
+        game = WhoIsUndercoverGame(AGENTS, GAME_THEMES, client=client, concurrency=concurrency)
+    game.echo = False
+    game.round_pause = 0
+    game.hedge_config["enabled"] = hedge
+    game.game_config["speculative_descriptions"] = speculative
+    game.game_config["vote_cutoff"] = vote_cutoff
+    return game
+
+
+def run_benchmark(games, latency, rtt, stream, concurrency=None, failure_rate=0.0, seed=None, hedge=False,
+                  speculative=False, provider="coze", vote_cutoff=False):
+    """依次运行多局游戏并汇总性能数据"""
+    random.seed(seed)
+    state = MockCozeState({"latency": latency, "failure_rate": failure_rate})
+    transport = FakeCozeTransport(state, rtt)
+    game = make_game(transport, stream, concurrency, hedge, speculative, provider, vote_cutoff)
+    timings = {phase: [] for phase in PHASES}
+    instrument(game, timings)
+
+    game_seconds = []
+    rounds = []
+    timeouts = {}
+    retries = {}
+    skipped_votes = 0
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(games):
+        start = time.perf_counter()
+        result = game.run_game()
+        game_seconds.append(time.perf_counter() - start)
+        rounds.append(result["rounds"])
+        for phase, count in result["timeouts"].items():
+            timeouts[phase] = timeouts.get(phase, 0) + count
+        for kind, count in result["retries"].items():
+            retries[kind] = retries.get(kind, 0) + count
+        skipped_votes += result["skipped_votes"]
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    return {
+        "config": {
+            "games": games, "latency": latency, "rtt": rtt, "stream": stream,
+            "failure_rate": failure_rate, "concurrency": game.concurrency, "seed": seed, "hedge": hedge,
+            "speculative": speculative, "provider": provider, "vote_cutoff": vote_cutoff
+        },
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "cpu_seconds_per_game": cpu / games if games else 0.0,
+        "games_per_hour": games / wall * 3600 if wall else 0.0,
+        "http_calls_per_game": transport.calls / games if games else 0.0,
+        "http_calls_by_path": dict(state.requests),
+        "rounds_per_game": sum(rounds) / games if games else 0.0,
+        "timeouts": timeouts,
+        "retries": retries,
+        "skipped_votes_per_game": skipped_votes / games if games else 0.0,
+        "hedges": dict(game.hedge_stats),
+        "rate_limit": game.client.stats().get("rate_limit"),
+        "latency_profiles": game.latency_profiles(),
+        "game": summarize(game_seconds),
+        "phases": {phase: summarize(values) for phase, values in timings.items()}
+    }
+
+
+def compare(current, baseline):
+    """打印与基准结果的对比"""
+    def change(new, old):
+        return f"{new:9.3f} (基准 {old:9.3f}, {((new - old) / old * 100) if old else 0:+6.1f}%)"
+
+    print("\n与基准结果对比:")
+    for phase in PHASES:
+        for key in ("p50", "p95", "p99"):
+            print(f"  {phase:16s} {key}: {change(current['phases'][phase][key], baseline['phases'][phase][key])}")
+    for key in ("games_per_hour", "http_calls_per_game", "cpu_seconds_per_game"):
+        print(f"  {key:20s}: {change(current[key], baseline[key])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="谁是卧底端到端性能测试")
+    parser.add_argument("--games", type=int, default=10, help="运行的局数")
+    parser.add_argument("--latency", default="lognormal:1.5:0.4", help="智能体完成一次对话的耗时分布")
+    parser.add_argument("--rtt", default="fixed:0.02", help="每个 HTTP 请求的网络往返耗时分布")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="对话失败的概率")
+    parser.add_argument("--poll", action="store_true", help="使用轮询而不是流式响应")
+    parser.add_argument("--concurrent", action="store_true", help="描述和投票环节并发请求")
+    parser.add_argument("--hedge", action="store_true", help="对慢请求发出对冲请求")
+    parser.add_argument("--provider", choices=("coze", "scripted", "embedding"), default="coze",
+                        help="coze 使用假传输层模拟接口; scripted/embedding 在进程内回答，只测量引擎自身的开销")
+    parser.add_argument("--speculative", action="store_true", help="投票期间推测性地发出下一轮的描述请求")
+    parser.add_argument("--vote-cutoff", action="store_true", help="淘汰结果确定后不再等待其余投票")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--output", default="benchmark.json", help="结果输出文件")
+    parser.add_argument("--compare", help="用于对比的基准结果文件")
+    args = parser.parse_args(argv)
+
+    concurrency = {"descriptions": True, "votes": True} if args.concurrent else None
+    result = run_benchmark(args.games, args.latency, args.rtt, not args.poll, concurrency,
+                           args.failure_rate, args.seed, args.hedge, args.speculative, args.provider,
+                           args.vote_cutoff)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"{args.games} 局, 每小时 {result['games_per_hour']:.1f} 局, "
+          f"每局 {result['http_calls_per_game']:.1f} 次 HTTP 请求, 每局 CPU {result['cpu_seconds_per_game']:.3f} 秒")
+    for phase, stats in result["phases"].items():
+        print(f"  {phase:16s} p50 {stats['p50']:.3f}s  p95 {stats['p95']:.3f}s  p99 {stats['p99']:.3f}s")
+    if any(result["timeouts"].values()):
+        print(f"  超时请求数: {result['timeouts']}")
+    if result["retries"]:
+        print(f"  重试次数: {result['retries']}")
+    if result["skipped_votes_per_game"]:
+        print(f"  每局提前结束的投票数: {result['skipped_votes_per_game']:.2f}")
+    if args.hedge:
+        print(f"  对冲请求: {result['hedges']}")
+    for bot_id, profile in result["latency_profiles"].items():
+        print(f"  bot {bot_id}: 平均 {profile['mean']:.3f}s  p50 {profile['p50']:.3f}s  "
+              f"p90 {profile['p90']:.3f}s  ({profile['count']} 次)")
+    print(f"结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,989 @@
+import os
+import json
+import time
+import random
+import heapq
+import asyncio
+import functools
+import itertools
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future, ThreadPoolExecutor, InvalidStateError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Coze 开放接口地址，可通过环境变量指向本地模拟服务(见 mock_server.py)
+COZE_BASE_URL = os.getenv("COZE_BASE_URL", "https://api.coze.cn")
+
+# 是否使用流式响应(SSE)，关闭后退回到 chat/retrieve 轮询方式
+USE_STREAM = True
+
+# 轮询配置(关闭流式响应时生效)
+POLL_CONFIG = {
+    "first_delay": 0.2,      # 首次查询前的等待时间(秒)
+    "multiplier": 1.6,       # 每次等待时间的增长倍数
+    "max_delay": 2.0,        # 单次等待时间上限(秒)
+    "jitter": 0.2,           # 等待时间的随机抖动比例
+    "deadline": 60,          # 调用方未指定截止时间时，单次对话的最长等待时间(秒)
+    "learned_ratio": 0.9,    # 首次查询时间占该智能体典型耗时的比例
+    "smoothing": 0.3,        # 学习典型耗时时的平滑系数
+    "poller_workers": 4,     # 集中轮询器发送请求使用的线程数
+    "query_attempts": 4      # 查询对话状态或消息时网络错误、服务端错误连续出现多少次后放弃该对话
+}
+
+# 连接池配置
+POOL_CONFIG = {
+    "pool_connections": 1,   # 缓存的主机连接池个数(只访问一个域名)
+    "pool_maxsize": None,    # 每个主机保持的长连接数，None 表示按智能体数量
+    "pool_block": False,     # 连接用尽时是否阻塞等待
+    "max_retries": 2,        # 连接失败或网关错误时的重试次数(仅对幂等的GET生效)
+    "backoff_factor": 0.3,   # 重试退避系数
+    "connect_timeout": 5,    # 建立连接的超时时间(秒)
+    "read_timeout": 30       # 等待响应数据的超时时间(秒)，不会超过调用截止时间的剩余部分
+}
+
+# 限流配置：按 (API 密钥, bot_id) 分别限速，同一进程内的客户端默认共用一个限流器
+RATE_LIMIT_CONFIG = {
+    "rate": None,            # 每秒允许发出的请求数(创建对话和查询状态都计入)，按 Coze 账号的实际配额设置；None 表示不限速，只按 429 退避
+    "burst": 10,             # 令牌桶容量，即允许的瞬时突发请求数
+    "retry_after": 1.0,      # 收到 429 但没有 Retry-After 头时的等待时间(秒)
+    "max_rate_limited": 8    # 没有截止时间的请求连续收到 429 的最多次数
+}
+
+
+# 重试配置：按错误类别决定是否重试，重试都在调用的截止时间之内进行
+RETRY_CONFIG = {
+    "max_attempts": 3,                                      # 每次调用最多尝试的次数(含第一次)
+    "base_delay": 0.5,                                      # 第一次重试前的等待时间(秒)，之后每次翻倍
+    "max_delay": 4.0,                                       # 单次等待时间上限(秒)
+    "jitter": 0.5,                                          # 等待时间的随机抖动比例
+    "retry_on": ("network", "server", "rate_limit", "timeout")  # 会重试的错误类别，permanent 从不重试
+}
+
+# 不会因重试而改变的接口错误码: 参数错误、鉴权失败、无权限、智能体或会话不存在
+PERMANENT_CODES = (4000, 4100, 4101, 4200)
+# 表示请求频率超限的接口错误码
+RATE_LIMIT_CODES = (4013,)
+
+
+class CozeError(RuntimeError):
+    """Coze 接口返回错误或对话未能正常完成，code 为接口返回的错误码(如果有)"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class CozeTimeout(CozeError):
+    """调用超过了截止时间"""
+
+
+class CozeRateLimited(CozeError):
+    """请求频率超过接口限制(HTTP 429)"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def classify_error(error):
+    """把调用异常归为 network / server / rate_limit / timeout / permanent 之一"""
+    if isinstance(error, CozeRateLimited):
+        return "rate_limit"
+    if isinstance(error, CozeTimeout):
+        return "timeout"
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        if status == 429:
+            return "rate_limit"
+        return "server" if status is not None and status >= 500 else "permanent"
+    if isinstance(error, (requests.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+        return "network"
+    if isinstance(error, CozeError):
+        if error.code in PERMANENT_CODES:
+            return "permanent"
+        return "rate_limit" if error.code in RATE_LIMIT_CODES else "server"
+    # 响应不是合法 JSON 或缺少字段
+    if isinstance(error, (ValueError, KeyError, IndexError)):
+        return "server"
+    return "permanent"
+
+
+def query_retry_delay(error, attempt, deadline=None, config=None):
+    """查询已创建的对话(chat/retrieve、message/list)第 attempt 次连续失败后，重新查询前应等待的秒数，
+    不应重试时返回 None
+
+    网络错误和服务端错误只说明这一次查询失败，对话本身仍在进行，重新查询同一个 chat_id 即可，不能重新发起对话。
+    """
+    cfg = config or POLL_CONFIG
+    if classify_error(error) not in ("network", "server") or attempt >= cfg["query_attempts"]:
+        return None
+    delay = min(cfg["first_delay"] * cfg["multiplier"] ** (attempt - 1), cfg["max_delay"])
+    if deadline is not None and delay >= deadline.remaining():
+        return None
+    return delay
+
+
+class RetryPolicy:
+    """按错误类别决定是否重试以及重试前等待多久(指数退避加抖动，不超过截止时间)"""
+
+    def __init__(self, config=None):
+        self.config = dict(RETRY_CONFIG, **(config or {}))
+
+    def next_delay(self, error, attempt, deadline=None):
+        """第 attempt 次尝试失败后，返回重试前应等待的秒数，不应重试时返回 None"""
+        cfg = self.config
+        if classify_error(error) not in cfg["retry_on"] or attempt >= cfg["max_attempts"]:
+            return None
+        delay = min(cfg["base_delay"] * 2 ** (attempt - 1), cfg["max_delay"])
+        delay *= random.uniform(1 - cfg["jitter"], 1 + cfg["jitter"])
+        if isinstance(error, CozeRateLimited) and error.retry_after:
+            delay = max(delay, error.retry_after)
+        # 等待之后至少要留出一点时间给下一次请求
+        if deadline is not None and delay >= deadline.remaining():
+            return None
+        return delay
+
+
+class Deadline:
+    """一次调用的截止时间，连接、读取超时和轮询都不会超过它"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+
+def parse_retry_after(value, default):
+    """解析 Retry-After 头(秒数或 HTTP 日期)，返回需要等待的秒数"""
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """令牌桶：按固定速率补充令牌，令牌不足的请求预订未来的令牌并排队等待"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()  # 上次补充令牌的时间，被 429 暂停时位于未来
+        self.lock = threading.Lock()
+
+    def wait_time(self):
+        """现在预订一个令牌需要等待的秒数(不预订)"""
+        with self.lock:
+            now = time.monotonic()
+            tokens = self.tokens
+            if now > self.updated:
+                tokens = min(tokens + (now - self.updated) * self.rate, self.burst)
+            return max(self.updated - now, 0) + max(1 - tokens, 0) / self.rate
+
+    def reserve(self, limit=None):
+        """预订一个令牌，返回需要等待的秒数；等待会超过 limit 时不预订，返回 None"""
+        with self.lock:
+            now = time.monotonic()
+            if now > self.updated:
+                self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+                self.updated = now
+            wait = (self.updated - now) + max(1 - self.tokens, 0) / self.rate
+            if limit is not None and wait > limit:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def pause(self, seconds):
+        """服务端要求暂停时清空令牌，seconds 秒内不再补充"""
+        with self.lock:
+            self.tokens = min(self.tokens, 0)
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """按 (API 密钥, bot_id) 分桶的限流器，取不到令牌时排队而不是报错"""
+
+    def __init__(self, config=None):
+        self.config = dict(RATE_LIMIT_CONFIG, **(config or {}))
+        self.buckets = {}
+        self.counters = {"throttled": 0, "wait_seconds": 0.0, "rate_limited": 0}
+        self.lock = threading.Lock()
+
+    def bucket(self, key):
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(self.config["rate"], self.config["burst"])
+            return self.buckets[key]
+
+    def acquire(self, key, deadline=None):
+        """等待直到可以发出请求，等待会超过截止时间时抛出 CozeTimeout"""
+        if self.config["rate"] is None:
+            return
+        wait = self.bucket(key).reserve(deadline.remaining() if deadline is not None else None)
+        if wait is None:
+            raise CozeTimeout("等待限流令牌将超过截止时间")
+        if wait > 0:
+            with self.lock:
+                self.counters["throttled"] += 1
+                self.counters["wait_seconds"] += wait
+            time.sleep(wait)
+
+    def wait_time(self, key):
+        """该桶现在发出请求需要排队的秒数，用于在多个密钥之间选择余量最大的一个"""
+        if self.config["rate"] is None:
+            return 0.0
+        with self.lock:
+            bucket = self.buckets.get(key)
+        return bucket.wait_time() if bucket is not None else 0.0
+
+    def rate_limited(self, key, retry_after):
+        """收到 429：该桶暂停 retry_after 秒"""
+        with self.lock:
+            self.counters["rate_limited"] += 1
+        if self.config["rate"] is not None:
+            self.bucket(key).pause(retry_after)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+# 进程内共用的限流器，同一 API 密钥的所有客户端都在这里排队
+default_rate_limiter = RateLimiter()
+
+
+def iter_sse_events(response):
+    """逐条解析服务端推送事件(SSE)，产出 (event, data) 二元组"""
+    event = None
+    data_lines = []
+    # 末尾补一个空行，保证最后一条事件也能被分发
+    for raw_line in itertools.chain(response.iter_lines(), [b""]):
+        line = raw_line.decode("utf-8") if isinstance(raw_line, bytes) else raw_line
+        # 空行表示一条事件结束
+        if not line:
+            if data_lines:
+                payload = "\n".join(data_lines)
+                try:
+                    payload = json.loads(payload)
+                except ValueError:
+                    pass
+                yield event, payload
+            event = None
+            data_lines = []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event = value
+        elif field == "data":
+            data_lines.append(value)
+
+
+def answer_from_messages(messages):
+    """从 message/list 的结果中取出智能体的回答"""
+    for message in messages:
+        if message.get("type") == "answer":
+            return message.get("content")
+    return messages[0]["content"] if messages else None
+
+
+def response_data(response):
+    """取出接口响应中的 data，接口返回错误码时抛出带错误码的 CozeError"""
+    result = response.json()
+    if result.get("code", 0) != 0 or "data" not in result:
+        raise CozeError(f"接口返回错误: {json.dumps(result, ensure_ascii=False)}", result.get("code"))
+    return result["data"]
+
+
+def settle(future, result=None, error=None):
+    """完成一个 Future，调用方已取消时忽略"""
+    if future.done():
+        return
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class PollScheduler:
+    """chat/retrieve 轮询调度器：指数退避加抖动，并按智能体学习典型完成耗时"""
+    TERMINAL_STATUSES = ("completed", "failed", "requires_action", "canceled")
+
+    def __init__(self, config=None):
+        self.config = dict(POLL_CONFIG, **(config or {}))
+        self.learned_latency = {}  # bot_id -> 平滑后的完成耗时(秒)
+        self.lock = threading.Lock()
+
+    def delays(self, key):
+        """依次产出每次查询前应等待的秒数"""
+        cfg = self.config
+        with self.lock:
+            learned = self.learned_latency.get(key)
+        # 首次查询落在该智能体的典型完成时间附近，没有历史数据时快速试探
+        delay = cfg["first_delay"]
+        if learned is not None:
+            delay = min(max(delay, learned * cfg["learned_ratio"]), cfg["deadline"])
+        yield delay
+        delay = cfg["first_delay"]
+        while True:
+            delay = min(delay * cfg["multiplier"], cfg["max_delay"])
+            yield delay * random.uniform(1 - cfg["jitter"], 1 + cfg["jitter"])
+
+    def record(self, key, elapsed):
+        """记录一次完成耗时，用指数滑动平均更新学习值"""
+        with self.lock:
+            learned = self.learned_latency.get(key)
+            if learned is None:
+                self.learned_latency[key] = elapsed
+            else:
+                alpha = self.config["smoothing"]
+                self.learned_latency[key] = alpha * elapsed + (1 - alpha) * learned
+
+
+class ChatPoller:
+    """集中轮询器：用一个调度线程跟踪所有在途对话
+
+    每个在途对话按 (conversation_id, chat_id) 登记在表中，调度线程按到期时间
+    依次把 chat/retrieve 查询交给少量工作线程；对话完成后获取 message/list
+    并完成对应的 Future。调用方无需为等待中的对话各占一个线程。
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.scheduler = client.poll_scheduler
+        self.table = {}  # (conversation_id, chat_id) -> 在途对话
+        self.heap = []   # (到期时间, 序号, 键)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.workers = ThreadPoolExecutor(max_workers=self.scheduler.config["poller_workers"])
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="coze-chat-poller", daemon=True)
+        self.thread.start()
+
+    def pending(self):
+        """当前在途的对话数"""
+        with self.cond:
+            return len(self.table)
+
+    def submit(self, bot_id, payload, conversation_id=None, on_created=None, deadline=None):
+        """在工作线程中发起对话并登记，返回以回答为结果的 Future"""
+        future = Future()
+        deadline = deadline or Deadline(self.scheduler.config["deadline"])
+        self.workers.submit(self.start, bot_id, payload, conversation_id, on_created, deadline, future)
+        return future
+
+    def start(self, bot_id, payload, conversation_id, on_created, deadline, future):
+        if future.cancelled():
+            return
+        try:
+            data = self.client.start_chat(payload, conversation_id, deadline)
+            if on_created:
+                on_created(data)
+        except Exception as e:
+            settle(future, error=e)
+            return
+        self.track(bot_id, data, future, deadline)
+
+    def track(self, bot_id, data, future, deadline):
+        """登记一个已创建的对话，按调度器给出的间隔安排查询"""
+        now = time.monotonic()
+        entry = {
+            "bot_id": bot_id,
+            "conversation_id": data["conversation_id"],
+            "chat_id": data["id"],
+            "status": data.get("status", "unknown"),
+            "start": now,
+            "deadline": deadline,
+            "delays": self.scheduler.delays(bot_id),
+            "errors": 0,
+            "future": future
+        }
+        key = (entry["conversation_id"], entry["chat_id"])
+        with self.cond:
+            self.table[key] = entry
+            self.schedule(key, now + next(entry["delays"]))
+
+    def schedule(self, key, due):
+        """安排下一次查询(调用方需持有锁)"""
+        heapq.heappush(self.heap, (due, next(self.seq), key))
+        self.cond.notify()
+
+    def run(self):
+        """调度线程：到期的对话交给工作线程查询"""
+        while True:
+            with self.cond:
+                while not self.closed and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                    self.cond.wait(timeout)
+                if self.closed:
+                    return
+                _, _, key = heapq.heappop(self.heap)
+                entry = self.table.get(key)
+            if entry is not None:
+                self.workers.submit(self.check, key, entry)
+
+    def finish(self, key, entry, result=None, error=None):
+        """对话结束：移出在途表并完成 Future"""
+        with self.cond:
+            self.table.pop(key, None)
+        settle(entry["future"], result, error)
+
+    def check(self, key, entry):
+        """查询一次对话状态，决定完成还是重新排期"""
+        # 调用方已放弃等待
+        if entry["future"].done():
+            self.finish(key, entry)
+            return
+        try:
+            deadline = entry["deadline"]
+            data = self.client.retrieve_chat(entry["conversation_id"], entry["chat_id"], deadline, entry["bot_id"])
+            status = data["status"]
+            if status == "completed":
+                self.scheduler.record(entry["bot_id"], time.monotonic() - entry["start"])
+                messages = self.client.list_messages(entry["conversation_id"], entry["chat_id"], deadline,
+                                                     entry["bot_id"])
+                self.finish(key, entry, answer_from_messages(messages))
+                return
+            if status in PollScheduler.TERMINAL_STATUSES:
+                last_error = data.get('last_error') or {}
+                self.finish(key, entry, error=CozeError(f"对话异常结束({status}): {last_error}", last_error.get("code")))
+                return
+        except Exception as e:
+            # 单次查询失败时稍后重新查询同一对话
+            entry["errors"] += 1
+            delay = query_retry_delay(e, entry["errors"], entry["deadline"], self.scheduler.config)
+            if delay is None:
+                self.finish(key, entry, error=e)
+                return
+            with self.cond:
+                self.schedule(key, time.monotonic() + delay)
+            return
+        entry["errors"] = 0
+
+        if entry["deadline"].expired():
+            self.finish(key, entry, error=CozeTimeout("对话状态: timeout"))
+            return
+        with self.cond:
+            self.schedule(key, min(time.monotonic() + next(entry["delays"]), entry["deadline"].expires_at))
+
+    def close(self):
+        """停止调度线程，未完成的对话以错误结束"""
+        with self.cond:
+            self.closed = True
+            entries = list(self.table.items())
+            self.cond.notify()
+        for key, entry in entries:
+            self.finish(key, entry, error=CozeError("轮询器已关闭"))
+        self.workers.shutdown(wait=False)
+
+
+class CozeClient:
+    """Coze 接口客户端：所有请求共用一个保持长连接的会话和连接池"""
+
+    def __init__(self, api_key, pool_size=4, stream=None, pool_config=None, poll_config=None, base_url=None,
+                 rate_limiter=None):
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter or default_rate_limiter
+        self.base_url = (base_url or COZE_BASE_URL).rstrip("/")
+        self.stream = USE_STREAM if stream is None else stream
+        self.pool_config = dict(POOL_CONFIG, **(pool_config or {}))
+        self.poll_scheduler = PollScheduler(poll_config)
+        self._poller = None
+        self._poller_lock = threading.Lock()
+
+        cfg = self.pool_config
+        # 只对幂等的查询请求重试，避免重复创建对话；429 交给限流器处理
+        retry = Retry(
+            total=cfg["max_retries"],
+            backoff_factor=cfg["backoff_factor"],
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=False
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=cfg["pool_connections"],
+            pool_maxsize=cfg["pool_maxsize"] or pool_size,
+            pool_block=cfg["pool_block"],
+            max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def stats(self):
+        """统计连接池中新建与复用的连接数"""
+        opened = 0
+        requests_sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            requests_sent += pool.num_requests
+        return {
+            "requests": requests_sent,
+            "connections_opened": opened,
+            "connections_reused": max(requests_sent - opened, 0),
+            "rate_limit": self.rate_limiter.stats()
+        }
+
+    @property
+    def poller(self):
+        """按需创建的集中轮询器"""
+        with self._poller_lock:
+            if self._poller is None:
+                self._poller = ChatPoller(self)
+            return self._poller
+
+    def close(self):
+        """关闭轮询器和会话，释放所有连接"""
+        if self._poller is not None:
+            self._poller.close()
+        self.session.close()
+
+    def request(self, method, path, deadline=None, bot_id=None, **kwargs):
+        """发送一个 HTTP 请求，连接和读取超时不超过截止时间的剩余部分
+
+        请求先在 (API 密钥, bot_id) 的令牌桶中排队；收到 429 时按 Retry-After 暂停该桶
+        后重新排队，直到截止时间(没有截止时间时最多重试 max_rate_limited 次)。
+        """
+        key = (self.api_key, bot_id)
+        limiter = self.rate_limiter
+        for attempt in itertools.count(1):
+            limiter.acquire(key, deadline)
+            connect, read = self.pool_config["connect_timeout"], self.pool_config["read_timeout"]
+            if deadline is not None:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    raise CozeTimeout(f"请求 {path} 前已超过截止时间")
+                connect, read = min(connect, remaining), min(read, remaining)
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", timeout=(connect, read), **kwargs)
+            except requests.Timeout as e:
+                raise CozeTimeout(f"请求 {path} 超时: {e}") from e
+            if response.status_code != 429:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"), limiter.config["retry_after"])
+            response.close()
+            limiter.rate_limited(key, retry_after)
+            if deadline is None and attempt >= limiter.config["max_rate_limited"]:
+                raise CozeRateLimited(f"请求 {path} 频率超限", retry_after)
+            if limiter.config["rate"] is None:
+                # 不限速时由这里自己等待
+                if deadline is not None and retry_after > deadline.remaining():
+                    raise CozeTimeout(f"请求 {path} 频率超限，等待将超过截止时间")
+                time.sleep(retry_after)
+
+    def build_chat_payload(self, bot_id, user_id, message, stream=False):
+        """构造发起对话的请求体"""
+        return {
+            "bot_id": bot_id,
+            "user_id": user_id,
+            "stream": stream,
+            "additional_messages": [
+                {
+                    "content": message,
+                    "content_type": "text",
+                    "role": "user",
+                    "type": "question"
+                }
+            ]
+        }
+
+    def chat(self, bot_id, user_id, message, on_delta=None, conversation_id=None, on_created=None, deadline=None):
+        """发起一次对话并返回智能体的完整回答
+
+        conversation_id 为空时由服务端新建会话；on_created 在对话创建后立即以
+        对话数据(包含 conversation_id 和 id)为参数调用。超过 deadline 时抛出 CozeTimeout。
+        """
+        if self.stream:
+            payload = self.build_chat_payload(bot_id, user_id, message, stream=True)
+            return self.stream_chat(payload, on_delta, conversation_id, on_created, deadline)
+
+        deadline = deadline or Deadline(self.poll_scheduler.config["deadline"])
+        payload = self.build_chat_payload(bot_id, user_id, message)
+        data = self.start_chat(payload, conversation_id, deadline)
+        if on_created:
+            on_created(data)
+        conversation_id = data['conversation_id']
+        chat_id = data['id']
+        status = self.wait_for_chat(bot_id, conversation_id, chat_id, data.get('status', 'unknown'), deadline)
+        if status == "timeout":
+            raise CozeTimeout("对话状态: timeout")
+        if status != "completed":
+            raise CozeError(f"对话状态: {status}")
+        return answer_from_messages(self.query_chat(self.list_messages, conversation_id, chat_id, deadline, bot_id))
+
+    def submit_chat(self, bot_id, user_id, message, conversation_id=None, on_created=None, deadline=None):
+        """非阻塞地发起对话(轮询方式)，由集中轮询器等待完成，返回以回答为结果的 Future"""
+        payload = self.build_chat_payload(bot_id, user_id, message)
+        return self.poller.submit(bot_id, payload, conversation_id, on_created, deadline)
+
+    def start_chat(self, payload, conversation_id=None, deadline=None):
+        """发起非流式对话，返回包含 conversation_id 和 id 的数据"""
+        params = {"conversation_id": conversation_id} if conversation_id else None
+        response = self.request("POST", "/v3/chat", deadline, payload.get("bot_id"), params=params, json=payload)
+        response.raise_for_status()
+        result = response.json()
+        if 'data' in result and 'conversation_id' in result['data']:
+            return result['data']
+        raise CozeError(f"无法获取conversation_id，响应内容: {json.dumps(result, ensure_ascii=False)}",
+                        result.get("code"))
+
+    def retrieve_chat(self, conversation_id, chat_id, deadline=None, bot_id=None):
+        """查询对话状态"""
+        params = {
+            "conversation_id": f"{conversation_id}",
+            "chat_id": f"{chat_id}"
+        }
+        response = self.request("GET", "/v3/chat/retrieve", deadline, bot_id, params=params)
+        response.raise_for_status()
+        return response_data(response)
+
+    def list_messages(self, conversation_id, chat_id, deadline=None, bot_id=None):
+        """获取对话产生的消息列表"""
+        params = {
+            "conversation_id": f"{conversation_id}",
+            "chat_id": f"{chat_id}"
+        }
+        response = self.request("GET", "/v3/chat/message/list", deadline, bot_id, params=params)
+        response.raise_for_status()
+        return response_data(response)
+
+    def query_chat(self, query, conversation_id, chat_id, deadline=None, bot_id=None):
+        """调用 retrieve_chat 或 list_messages 查询已创建的对话，网络错误和服务端错误时稍后重新查询"""
+        for attempt in itertools.count(1):
+            try:
+                return query(conversation_id, chat_id, deadline, bot_id)
+            except Exception as e:
+                delay = query_retry_delay(e, attempt, deadline, self.poll_scheduler.config)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def cancel_chat(self, conversation_id, chat_id, bot_id=None):
+        """取消一个进行中的对话"""
+        payload = {"conversation_id": f"{conversation_id}", "chat_id": f"{chat_id}"}
+        response = self.request("POST", "/v3/chat/cancel", None, bot_id, json=payload)
+        response.raise_for_status()
+        return response_data(response)
+
+    def checkout(self, bot_id, conversation_id=None, on_created=None):
+        """选出发送本次对话的客户端，返回 (客户端, bot_id, on_created, release)
+
+        单密钥时就是自身；CozeKeyPool 会按负载选择密钥并换成该密钥下的 bot_id。
+        对话结束后调用 release(error) 归还。
+        """
+        return self, bot_id, on_created, lambda error=None: None
+
+    def reset_conversations(self):
+        """新的一局开始：单密钥时会话都在服务端，本地没有需要丢弃的状态"""
+
+    def wait_for_chat(self, bot_id, conversation_id, chat_id, status, deadline=None):
+        """轮询 chat/retrieve 直到对话结束，返回最终状态(超过截止时间返回 "timeout")"""
+        start = time.monotonic()
+        deadline = deadline or Deadline(self.poll_scheduler.config["deadline"])
+        for delay in self.poll_scheduler.delays(bot_id):
+            if status in PollScheduler.TERMINAL_STATUSES:
+                break
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                return "timeout"
+            time.sleep(min(delay, remaining))
+            if deadline.expired():
+                return "timeout"
+
+            data = self.query_chat(self.retrieve_chat, conversation_id, chat_id, deadline, bot_id)
+            status = data['status']
+            if status in ("failed", "requires_action"):
+                last_error = data.get('last_error') or {}
+                raise CozeError(f"对话异常结束({status}): {last_error}", last_error.get("code"))
+
+        if status == "completed":
+            self.poll_scheduler.record(bot_id, time.monotonic() - start)
+        return status
+
+    def stream_chat(self, payload, on_delta=None, conversation_id=None, on_created=None, deadline=None):
+        """以流式方式发起对话，边接收边回调部分回复，收到完整回答后立即返回
+
+        read 超时限制的是两次收到数据之间的间隔，整体耗时由每个事件后检查 deadline 保证。
+        """
+        partial = ""
+        params = {"conversation_id": conversation_id} if conversation_id else None
+        with self.request("POST", "/v3/chat", deadline, payload.get("bot_id"), params=params, json=payload,
+                          stream=True) as response:
+            response.raise_for_status()
+            # 参数或鉴权错误时接口直接返回JSON而不是事件流
+            if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                result = response.json()
+                raise CozeError(f"无法建立流式对话，响应内容: {json.dumps(result, ensure_ascii=False)}",
+                                result.get("code"))
+
+            for event, data in iter_sse_events(response):
+                if deadline is not None and deadline.expired():
+                    raise CozeTimeout("接收事件流超过截止时间")
+                if event == "conversation.chat.created":
+                    if on_created:
+                        on_created(data)
+                elif event == "conversation.message.delta":
+                    if data.get("type") == "answer":
+                        partial += data.get("content", "")
+                        if on_delta:
+                            on_delta(partial)
+                elif event == "conversation.message.completed":
+                    # 收到完整回答即返回，不再等待后续的 follow_up 等事件
+                    if data.get("type") == "answer":
+                        return data.get("content") or partial
+                elif event in ("conversation.chat.failed", "error"):
+                    code = None
+                    if isinstance(data, dict):
+                        code = data.get("code") or (data.get("last_error") or {}).get("code")
+                    raise CozeError(f"对话失败: {json.dumps(data, ensure_ascii=False)}", code)
+
+        # 事件流结束但没有收到完整消息时，退回使用已拼接的部分内容
+        if not partial:
+            raise CozeError("事件流结束，未收到回答")
+        return partial
+
+
+class CozeKeyPool:
+    """多个 API 密钥组成的客户端池，接口与 CozeClient 相同
+
+    每个密钥各用一个 CozeClient(各自的连接池和限流桶)。新对话分给限流余量最大、
+    在途对话最少的密钥；已建立的会话只属于创建它的密钥，后续对话固定发到该密钥。
+    keys 中每项可以是密钥字符串，或 {"api_key": 密钥, "bot_ids": {原 bot_id: 该密钥下的 bot_id}}。
+    """
+
+    def __init__(self, keys, pool_size=4, **client_options):
+        if not keys:
+            raise ValueError("至少需要一个 API 密钥")
+        self.entries = []
+        for index, key in enumerate(keys):
+            if isinstance(key, str):
+                key = {"api_key": key}
+            self.entries.append({
+                "label": f"key{index + 1}({key['api_key'][-4:]})",
+                "client": CozeClient(key["api_key"], pool_size, **client_options),
+                "bot_ids": dict(key.get("bot_ids") or {}),
+                "chats": 0,      # 分到该密钥的对话数
+                "in_flight": 0,  # 当前在途的对话数
+                "errors": 0      # 失败的对话数
+            })
+        self.stream = self.entries[0]["client"].stream
+        self.owners = {}  # conversation_id -> 创建该会话的密钥，新的一局开始时丢弃
+        self.active = {}  # conversation_id -> 该会话中在途的对话数，这些会话的归属在丢弃时保留
+        self.lock = threading.Lock()
+
+    def select(self, bot_id):
+        """选出限流等待最短、在途对话最少的密钥(调用方需持有锁)"""
+        def load(entry):
+            client = entry["client"]
+            key = (client.api_key, entry["bot_ids"].get(bot_id, bot_id))
+            return round(client.rate_limiter.wait_time(key), 2), entry["in_flight"], entry["chats"]
+        return min(self.entries, key=load)
+
+    def checkout(self, bot_id, conversation_id=None, on_created=None):
+        """选出发送本次对话的密钥，返回值同 CozeClient.checkout"""
+        with self.lock:
+            entry = self.owners.get(conversation_id) if conversation_id else None
+            entry = entry or self.select(bot_id)
+            entry["chats"] += 1
+            entry["in_flight"] += 1
+
+        conversations = []
+
+        def created(data):
+            with self.lock:
+                self.owners.setdefault(data["conversation_id"], entry)
+                self.active[data["conversation_id"]] = self.active.get(data["conversation_id"], 0) + 1
+                conversations.append(data["conversation_id"])
+            if on_created:
+                on_created(data)
+
+        def release(error=None):
+            with self.lock:
+                entry["in_flight"] -= 1
+                entry["errors"] += error is not None
+                for conversation in conversations:
+                    self.active[conversation] -= 1
+                    if not self.active[conversation]:
+                        del self.active[conversation]
+        return entry["client"], entry["bot_ids"].get(bot_id, bot_id), created, release
+
+    def reset_conversations(self):
+        """新的一局开始：丢弃已结束会话的归属记录，仍有在途对话的会话保留，取消时还能发到原密钥"""
+        with self.lock:
+            self.owners = {conversation: entry for conversation, entry in self.owners.items()
+                           if conversation in self.active}
+
+    def chat(self, bot_id, user_id, message, on_delta=None, conversation_id=None, on_created=None, deadline=None):
+        """参数同 CozeClient.chat"""
+        client, bot_id, on_created, release = self.checkout(bot_id, conversation_id, on_created)
+        try:
+            answer = client.chat(bot_id, user_id, message, on_delta, conversation_id, on_created, deadline)
+        except Exception as e:
+            release(e)
+            raise
+        release()
+        return answer
+
+    def submit_chat(self, bot_id, user_id, message, conversation_id=None, on_created=None, deadline=None):
+        """参数同 CozeClient.submit_chat"""
+        client, bot_id, on_created, release = self.checkout(bot_id, conversation_id, on_created)
+        future = client.submit_chat(bot_id, user_id, message, conversation_id, on_created, deadline)
+        future.add_done_callback(lambda f: release(None if f.cancelled() else f.exception()))
+        return future
+
+    def cancel_chat(self, conversation_id, chat_id, bot_id=None):
+        """取消对话，请求发到创建该会话的密钥"""
+        with self.lock:
+            entry = self.owners.get(conversation_id, self.entries[0])
+        return entry["client"].cancel_chat(conversation_id, chat_id, entry["bot_ids"].get(bot_id, bot_id))
+
+    def stats(self):
+        """每个密钥的用量(限流统计由所有密钥共用的限流器给出，不按密钥区分)"""
+        keys = {}
+        with self.lock:
+            for entry in self.entries:
+                stats = entry["client"].stats()
+                stats.pop("rate_limit")
+                keys[entry["label"]] = dict(stats, chats=entry["chats"], in_flight=entry["in_flight"],
+                                            errors=entry["errors"])
+        return keys
+
+    def close(self):
+        for entry in self.entries:
+            entry["client"].close()
+
+
+class AsyncCozeClient:
+    """CozeClient 的 asyncio 封装
+
+    阻塞的 HTTP 请求放到线程池里执行，等待对话完成的过程在事件循环中进行，
+    因此轮询模式下一个线程池就能同时维持大量在途对话。流式模式下每个对话
+    在接收事件流期间会占用一个线程。
+    """
+
+    def __init__(self, client, max_workers=16):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def run(self, func, *args, **kwargs):
+        """在线程池中执行一个阻塞调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def chat(self, bot_id, user_id, message, on_delta=None, conversation_id=None, on_created=None,
+                   multiplex=False, deadline=None):
+        """发起一次对话并返回智能体的完整回答，参数同 CozeClient.chat
+
+        multiplex 为 True 时(仅轮询方式)交给客户端的集中轮询器等待完成。
+        """
+        client, bot_id, on_created, release = self.client.checkout(bot_id, conversation_id, on_created)
+        try:
+            answer = await self.chat_on(client, bot_id, user_id, message, on_delta, conversation_id, on_created,
+                                        multiplex, deadline)
+        except BaseException as e:
+            release(e)
+            raise
+        release()
+        return answer
+
+    async def chat_on(self, client, bot_id, user_id, message, on_delta, conversation_id, on_created, multiplex,
+                      deadline):
+        """在选定的客户端上完成一次对话"""
+        # 其他提供方(见 providers.py)只提供阻塞的 chat：进程内的直接调用，其余放到线程池中执行
+        if not isinstance(client, CozeClient):
+            if client.in_process:
+                return client.chat(bot_id, user_id, message, on_delta, conversation_id, on_created, deadline)
+            return await self.run(client.chat, bot_id, user_id, message, on_delta, conversation_id, on_created,
+                                  deadline)
+        if client.stream:
+            payload = client.build_chat_payload(bot_id, user_id, message, stream=True)
+            return await self.run(client.stream_chat, payload, on_delta, conversation_id, on_created, deadline)
+        deadline = deadline or Deadline(client.poll_scheduler.config["deadline"])
+        if multiplex:
+            future = client.submit_chat(bot_id, user_id, message, conversation_id, on_created, deadline)
+            return await asyncio.wrap_future(future)
+
+        payload = client.build_chat_payload(bot_id, user_id, message)
+        data = await self.run(client.start_chat, payload, conversation_id, deadline)
+        if on_created:
+            on_created(data)
+        conversation_id = data['conversation_id']
+        chat_id = data['id']
+        status = await self.wait_for_chat(bot_id, conversation_id, chat_id, data.get('status', 'unknown'), deadline,
+                                          client)
+        if status == "timeout":
+            raise CozeTimeout("对话状态: timeout")
+        if status != "completed":
+            raise CozeError(f"对话状态: {status}")
+        messages = await self.query_chat(client, client.list_messages, conversation_id, chat_id, deadline, bot_id)
+        return answer_from_messages(messages)
+
+    async def query_chat(self, client, query, conversation_id, chat_id, deadline=None, bot_id=None):
+        """与 CozeClient.query_chat 相同，但等待重新查询期间不占用线程"""
+        for attempt in itertools.count(1):
+            try:
+                return await self.run(query, conversation_id, chat_id, deadline, bot_id)
+            except Exception as e:
+                delay = query_retry_delay(e, attempt, deadline, client.poll_scheduler.config)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def wait_for_chat(self, bot_id, conversation_id, chat_id, status, deadline=None, client=None):
+        """与 CozeClient.wait_for_chat 相同，但等待期间不占用线程"""
+        client = client or self.client
+        scheduler = client.poll_scheduler
+        start = time.monotonic()
+        deadline = deadline or Deadline(scheduler.config["deadline"])
+        for delay in scheduler.delays(bot_id):
+            if status in PollScheduler.TERMINAL_STATUSES:
+                break
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                return "timeout"
+            await asyncio.sleep(min(delay, remaining))
+            if deadline.expired():
+                return "timeout"
+
+            data = await self.query_chat(client, client.retrieve_chat, conversation_id, chat_id, deadline, bot_id)
+            status = data['status']
+            if status in ("failed", "requires_action"):
+                last_error = data.get('last_error') or {}
+                raise CozeError(f"对话异常结束({status}): {last_error}", last_error.get("code"))
+
+        if status == "completed":
+            scheduler.record(bot_id, time.monotonic() - start)
+        return status
+
+    def close(self):
+        """关闭线程池和底层客户端"""
+        self.executor.shutdown(wait=False)
+        self.client.close()
@@ -0,0 +1,196 @@
+"""基于词向量的本地玩家，用于大批量模拟
+
+词向量表为内存映射读取的 .npy 矩阵(每行一个已归一化的词向量)，词表保存在同名的 .vocab.json 中。
+描述时从自己词语的近义词中挑一个说出来，投票时把其他玩家的描述一次性向量化，投给与自己词语
+余弦相似度最低的玩家。
+
+生成词向量表(word2vec 文本格式，第一行为 "词数 维数"):
+    python -m embedding_player build vectors.txt --output word_vectors.npy --limit 200000
+"""
+import re
+import json
+import random
+import argparse
+import threading
+import numpy as np
+from providers import AgentProvider
+
+# 本地玩家默认配置
+EMBEDDING_CONFIG = {
+    "vectors": "word_vectors.npy",  # 词向量表，词表为同名的 .vocab.json
+    "neighbors": 20,                # 描述时从最相近的多少个词中挑选
+    "max_word_length": 4            # 切分描述时词表中词语的最大长度
+}
+
+# 描述模板，{word} 为挑选出的相关词语
+DESCRIPTION_TEMPLATES = [
+    "说到它我会想到{word}。",
+    "它和{word}有点关系。",
+    "看到{word}的时候容易联想到它。",
+    "它让我想起{word}。"
+]
+
+# 已加载的词向量表，同一进程中的多个本地玩家共用
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class WordVectors:
+    """内存映射的词向量表"""
+
+    def __init__(self, path):
+        self.matrix = np.load(path, mmap_mode="r")
+        with open(re.sub(r"\.npy$", "", path) + ".vocab.json", encoding="utf-8") as f:
+            self.words = json.load(f)
+        self.index = {word: i for i, word in enumerate(self.words)}
+        self.neighbor_cache = {}
+        self.lock = threading.Lock()
+
+    def tokens(self, text, max_length):
+        """按词表从左到右做最长匹配，返回词表中的词语"""
+        found = []
+        i = 0
+        while i < len(text):
+            for length in range(min(max_length, len(text) - i), 0, -1):
+                if text[i:i + length] in self.index:
+                    found.append(text[i:i + length])
+                    i += length
+                    break
+            else:
+                i += 1
+        return found
+
+    def embed(self, texts, max_length):
+        """一组文本的向量(文本中词语向量的平均值再归一化)，没有已知词语的文本为零向量"""
+        vectors = np.zeros((len(texts), self.matrix.shape[1]), dtype=np.float32)
+        for row, text in enumerate(texts):
+            ids = [self.index[word] for word in self.tokens(text, max_length)]
+            if ids:
+                vectors[row] = self.matrix[sorted(ids)].mean(axis=0)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+    def neighbors(self, word, count, max_length):
+        """与词语最相近的若干个词，不包含与它互相包含的词(避免直接说出词语)"""
+        with self.lock:
+            if word in self.neighbor_cache:
+                return self.neighbor_cache[word]
+        query = self.embed([word], max_length)[0]
+        if not query.any():
+            return []
+        scores = self.matrix @ query
+        top = np.argpartition(-scores, min(count * 2, len(scores) - 1))[:count * 2]
+        ranked = [self.words[i] for i in top[np.argsort(-scores[top])]]
+        related = [w for w in ranked if word not in w and w not in word][:count]
+        with self.lock:
+            self.neighbor_cache[word] = related
+        return related
+
+
+def load_vectors(path):
+    """读取词向量表，同一路径只加载一次"""
+    with _tables_lock:
+        if path not in _tables:
+            _tables[path] = WordVectors(path)
+        return _tables[path]
+
+
+class EmbeddingProvider(AgentProvider):
+    """按词向量描述和投票的本地玩家，作为 AGENTS 中的 provider 使用: {"type": "embedding", ...}"""
+
+    in_process = True
+
+    def __init__(self, vectors=None, neighbors=None, max_word_length=None, names=None):
+        super().__init__()
+        self.names = names or {}  # 使用该提供方的智能体 {user_id: 名字}，投票时排除自己
+        self.config = dict(EMBEDDING_CONFIG)
+        for key, value in (("vectors", vectors), ("neighbors", neighbors), ("max_word_length", max_word_length)):
+            if value is not None:
+                self.config[key] = value
+        self.table = load_vectors(self.config["vectors"])
+
+    def complete(self, bot_id, history, on_delta, deadline, chat):
+        self.check_canceled(chat)
+        message = history[-1]["content"]
+        if "不用给出描述" in message:
+            answer = "好的，我记住了。"
+        elif "投票" in message:
+            answer = self.vote(history, message, self.names.get(chat.get("user_id")))
+        else:
+            answer = self.describe(history)
+        if on_delta:
+            on_delta(answer)
+        return answer
+
+    def recall(self, history, pattern):
+        """从会话历史中找出最近一次出现的信息(词语或名字)"""
+        for item in reversed(history):
+            if item["role"] == "user":
+                match = re.search(pattern, item["content"])
+                if match:
+                    return match.group(1).strip()
+        return None
+
+    def describe(self, history):
+        """从自己词语的近义词中随机挑一个组成描述"""
+        word = self.recall(history, r"你的词语是: (.+?)。")
+        related = self.table.neighbors(word, self.config["neighbors"], self.config["max_word_length"]) if word else []
+        if not related:
+            return "这是日常生活中很常见的东西。"
+        return random.choice(DESCRIPTION_TEMPLATES).format(word=random.choice(related))
+
+    def vote(self, history, message, name=None):
+        """把其他玩家的描述一次性向量化，投给与自己词语余弦相似度最低的玩家"""
+        options = re.findall(r"^(\d+)\. (.+?): (.*)$", message, re.MULTILINE)
+        # 没有配置名字时从带词语的消息中读取(投票请求里的 "你是: " 没有填入名字)
+        name = name or self.recall(history, r"你是: (\S+) 你的词语是")
+        options = [option for option in options if option[1] != name]
+        if not options:
+            return "我无法判断。"
+        word = self.recall(history, r"你的词语是: (.+?)。")
+        if not word:
+            return f"我投 {random.choice(options)[0]} 号。"
+        max_length = self.config["max_word_length"]
+        query = self.table.embed([word], max_length)[0]
+        scores = self.table.embed([description for _, _, description in options], max_length) @ query
+        return f"我投 {options[int(np.argmin(scores))][0]} 号。"
+
+
+def build(source, output, limit=None):
+    """把 word2vec 文本格式的词向量转换为归一化的 .npy 矩阵和词表"""
+    words = []
+    rows = []
+    with open(source, encoding="utf-8", errors="ignore") as f:
+        header = f.readline().split()
+        dim = int(header[1])
+        for line in f:
+            parts = line.rstrip().split(" ")
+            if len(parts) != dim + 1:
+                continue
+            words.append(parts[0])
+            rows.append(np.asarray(parts[1:], dtype=np.float32))
+            if limit and len(words) >= limit:
+                break
+    matrix = np.vstack(rows)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-8)
+    np.save(output, matrix)
+    with open(re.sub(r"\.npy$", "", output) + ".vocab.json", "w", encoding="utf-8") as f:
+        json.dump(words, f, ensure_ascii=False)
+    return matrix.shape
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m embedding_player", description="基于词向量的本地玩家")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="由 word2vec 文本格式的词向量生成 .npy 词向量表")
+    build_parser.add_argument("source", help="word2vec 文本格式的词向量文件")
+    build_parser.add_argument("--output", default=EMBEDDING_CONFIG["vectors"], help="输出的 .npy 文件")
+    build_parser.add_argument("--limit", type=int, default=None, help="只保留前多少个词(按文件中的顺序)")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        count, dim = build(args.source, args.output, args.limit)
+        print(f"已写入 {args.output}: {count} 个词, {dim} 维")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1203 @@
+import os
+import json
+import random
+import time
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from coze_client import CozeClient, CozeKeyPool, CozeError, CozeTimeout, Deadline, RetryPolicy, classify_error, settle
+from providers import ProviderRouter, agent_providers
+
+# 加载环境变量
+load_dotenv()
+
+# 获取API密钥(在创建客户端时才检查，便于无密钥环境导入游戏逻辑)
+API_KEY = os.getenv("COZE_API_KEY")
+
+
+def load_api_keys():
+    """读取批量运行使用的密钥池
+
+    优先读取 COZE_KEYS_FILE 指向的 JSON 文件(列表，每项为 {"api_key": ..., "bot_ids": {原 bot_id: 该密钥下的 bot_id}})，
+    其次是 COZE_API_KEYS 中以逗号分隔的多个密钥，最后退回 COZE_API_KEY。
+    """
+    keys_file = os.getenv("COZE_KEYS_FILE")
+    if keys_file:
+        with open(keys_file, encoding="utf-8") as f:
+            return json.load(f)
+    keys = [key.strip() for key in os.getenv("COZE_API_KEYS", "").split(",") if key.strip()]
+    return keys or ([API_KEY] if API_KEY else [])
+
+# 游戏配置
+GAME_CONFIG = {
+    "reuse_conversation": True,   # 每局为每个智能体保持一个会话，后续请求都发到该会话；关闭后每次请求都新建会话
+    "init_mode": "ack",           # 开局分发词语的方式: ack 等待所有玩家确认; async 后台发送不阻塞第一轮; skip 不单独发送，词语随第一轮描述请求一起发出
+    "pipeline_rounds": False,     # 淘汰结果确定后立即在后台发出下一轮的描述请求，与展示投票结果的停顿重叠(自动进行模式使用)
+    "vote_cutoff": False,         # 已收到的票决定了淘汰结果(剩余的票无法改变得票最多者)时不再等待其余投票，并取消仍在进行的投票请求
+    "speculative_descriptions": False  # 投票开始时就为所有存活玩家发出下一轮的描述请求，淘汰后只丢弃出局玩家的结果；
+                                       # 这些请求与投票同时进行，发到新会话并带上词语，不进入玩家本局会话的历史
+}
+
+# 并发配置
+CONCURRENCY_CONFIG = {
+    "descriptions": False,        # 描述环节是否同时向所有玩家发出请求
+    "init": True,                 # 开局时是否同时向所有玩家分发词语
+    "votes": False,               # 投票环节是否同时向所有玩家发出请求
+    "max_workers": 8,             # 并发请求使用的线程数，同时也是在途请求数上限
+    "multiplex": False,           # 轮询方式下由客户端的集中轮询器等待所有在途对话，不再每个请求占用一个线程
+    "longest_first": True         # 并发请求按各 bot 近期平均耗时从慢到快依次发出(没有样本的最先)，玩家数超过线程数时缩短整个环节
+}
+
+# 各 bot 近期耗时的保存文件，界面版本启动时读取、每局结束时写入，跨次运行保留
+LATENCY_PROFILE_FILE = os.getenv("COZE_LATENCY_PROFILE", "latency_profiles.json")
+
+# 各环节单次请求的时间预算(秒)，作为请求的截止时间传给客户端(连接/读取超时和轮询都不会超过它)
+# 超时后按原有方式处理：描述记为无法获取有效回复，投票随机分配
+PHASE_BUDGETS = {
+    "init": 90,                   # 分发词语
+    "description": 90,            # 描述
+    "vote": 60                    # 投票
+}
+
+# 外层等待在时间预算之外多留的时间(秒)，让请求先按自身的截止时间结束
+DEADLINE_GRACE = 2
+
+# 熔断配置：智能体连续失败后不再等它超时，改用 AGENTS 中配置的备用 standby_bot_id，没有备用时由本地兜底回复
+BREAKER_CONFIG = {
+    "failure_threshold": 3,       # 连续失败(含超时和空回复)多少次后断开
+    "reset_timeout": 30           # 断开多久后放行一个试探请求(秒)，试探成功即恢复
+}
+
+# 对冲请求配置：描述和投票请求超过该 bot 近期耗时的高分位仍未完成时，在新会话中再发一次相同的请求，
+# 取先完成的结果并取消另一个(轮询方式下的集中轮询器路径不对冲)
+HEDGE_CONFIG = {
+    "enabled": False,
+    "phases": ("description", "vote"),  # 对哪些环节的请求对冲
+    "quantile": 90,               # 超过近期耗时的第几百分位时发出对冲请求
+    "min_samples": 10,            # 该 bot 的耗时样本少于此数时不对冲
+    "max_rate": 0.1,              # 对冲请求数占可对冲请求数的比例上限
+    "window": 50                  # 每个 bot 保留最近多少次的耗时
+}
+
+# 本地兜底玩家使用的描述
+FALLBACK_DESCRIPTIONS = [
+    "这是日常生活中很常见的东西。",
+    "很多人都接触过它。",
+    "它有好几种不同的类型。"
+]
+
+# 智能体配置，可选 standby_bot_id 指定主 bot 熔断期间使用的备用 bot，
+# 可选 provider 指定由谁回答(默认 coze，另有 openai 兼容接口和进程内的 scripted，见 providers.py)
+AGENTS = {
+    "agent1": {
+        "name": "谁是卧底1",
+        "bot_id": "7516937350422462500",
+        "user_id": "user1",
+        "color": "#FFB6C1"  # 浅粉色
+    },
+    "agent2": {
+        "name": "谁是卧底2",
+        "bot_id": "7516949959041105960",
+        "user_id": "user2",
+        "color": "#ADD8E6"  # 浅蓝色
+    },
+    "agent3": {
+        "name": "谁是卧底3",
+        "bot_id": "7516952335664021558",
+        "user_id": "user3",
+        "color": "#90EE90"  # 浅绿色
+    },
+    "agent4": {
+        "name": "谁是卧底4",
+        "bot_id": "7516953397153792036",
+        "user_id": "user4",
+        "color": "#FFFACD"  # 浅黄色
+    }
+}
+
+# 游戏主题配置
+GAME_THEMES = [
+    {"majority": "电脑", "minority": "笔记本"},
+    {"majority": "西瓜", "minority": "南瓜"},
+    {"majority": "足球", "minority": "篮球"},
+    {"majority": "电影", "minority": "电视剧"},
+    {"majority": "苹果", "minority": "梨"},
+    {"majority": "咖啡", "minority": "奶茶"},
+    {"majority": "微信", "minority": "QQ"},
+    {"majority": "地铁", "minority": "公交车"},
+    {"majority": "风扇", "minority": "空调"},
+    {"majority": "太阳", "minority": "月亮"}
+]
+
+# 游戏事件，用法与 pyqtSignal 相同(connect 注册回调，emit 触发)，不依赖 Qt
+class Event:
+    def __init__(self):
+        self.callbacks = []
+        
+    def connect(self, callback):
+        self.callbacks.append(callback)
+        
+    def disconnect(self, callback):
+        self.callbacks.remove(callback)
+        
+    def emit(self, *args):
+        for callback in list(self.callbacks):
+            callback(*args)
+
+# 游戏事件集合，界面可以传入属性相同的 Qt 信号类代替
+class GameEvents:
+    def __init__(self):
+        self.update_log = Event()
+        self.update_status = Event()
+        self.round_complete = Event()
+        self.game_over = Event()
+        self.player_eliminated = Event()  # player_key, is_undercover
+        self.update_player_status = Event()  # player_key, status, message
+        self.initialized = Event()  # 词语分发完成
+        self.round_finished = Event()  # 一轮(含投票)结束，{"round": 轮次, "game_over": 是否结束}
+
+# 单个智能体的熔断器: closed 正常请求; open 直接走备用; half_open 放行一个试探请求
+class CircuitBreaker:
+    def __init__(self, config=None):
+        self.config = dict(BREAKER_CONFIG, **(config or {}))
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+        
+    def allow(self):
+        """是否向主 bot 发送请求；断开超过 reset_timeout 后放行一个试探请求"""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            # 试探请求迟迟没有结果(例如被取消)时，到时间后再放行一个
+            if time.monotonic() - self.opened_at >= self.config["reset_timeout"]:
+                self.state = "half_open"
+                self.opened_at = time.monotonic()
+                return True
+            return False
+        
+    def record(self, success):
+        """记录一次主 bot 请求的结果，返回熔断器是否刚刚断开"""
+        with self.lock:
+            if success:
+                self.state = "closed"
+                self.failures = 0
+                return False
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.config["failure_threshold"]):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+# 增量计票：每收到一票就判断淘汰结果是否已经确定
+class VoteTally:
+    def __init__(self, players):
+        self.counts = {player: 0 for player in players}
+        self.remaining = len(self.counts)
+        
+    def add(self, voted):
+        """记入一票"""
+        self.counts[voted] += 1
+        self.remaining -= 1
+        
+    def decided(self):
+        """剩余的票全部投给第二名也追不上第一名时返回第一名，否则返回 None"""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        if ranked and ranked[0][1] > runner_up + self.remaining:
+            return ranked[0][0]
+        return None
+
+# 游戏逻辑类
+class WhoIsUndercoverGame:
+    def __init__(self, agents, game_themes, client=None, concurrency=None, signals=None, config=None, budgets=None):
+        self.agents = agents
+        self.game_themes = game_themes
+        self.current_theme = None
+        self.undercover = None
+        self.players_alive = list(agents.keys())
+        self.eliminated_players = []
+        self.round = 0
+        self.game_history = []
+        self.conversations = {}  # player_key -> 本局使用的 conversation_id
+        self.pending_acks = {}  # player_key -> 尚未完成的词语确认请求
+        self.prefetched = None  # 提前发出的下一轮描述请求
+        self.budgets = dict(PHASE_BUDGETS, **(budgets or {}))
+        self.timeouts = {phase: 0 for phase in self.budgets}  # 本局各环节超时的请求数
+        self.retry_policy = RetryPolicy()
+        self.retries = {}  # 本局按错误类别统计的重试次数
+        self.skipped_votes = 0  # 本局因淘汰结果已确定而不再等待的投票数
+        self.in_flight = {}  # id(请求) -> 正在进行的请求 {"player", "phase", "chats": 已创建的对话, "cut_off": 是否已不再需要}
+        self.timeouts_lock = threading.Lock()
+        self.game_config = dict(GAME_CONFIG, **(config or {}))
+        self.signals = signals or GameEvents()
+        self.echo = True  # 是否把日志打印到控制台
+        self.round_pause = 2  # run_game 两轮之间的停顿(秒)
+        # 所有智能体共用一个客户端，连接池大小与智能体数量一致；配置了多个密钥时按负载分摊到各密钥
+        # 全部智能体都使用其他提供方且没有备用 bot 时不需要 Coze 密钥
+        providers = agent_providers(agents)
+        needs_coze = any(agent["bot_id"] not in providers or agent.get("standby_bot_id") for agent in agents.values())
+        if client is None and needs_coze:
+            keys = load_api_keys()
+            if not keys:
+                raise ValueError("请在.env文件中设置COZE_API_KEY")
+            if len(keys) == 1 and isinstance(keys[0], str):
+                client = CozeClient(keys[0], pool_size=len(agents))
+            else:
+                client = CozeKeyPool(keys, pool_size=len(agents))
+        if providers:
+            client = ProviderRouter(client, providers)
+        self.client = client
+        self.concurrency = dict(CONCURRENCY_CONFIG, **(concurrency or {}))
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency["max_workers"])
+        # 熔断器跨局保留，坏掉的 bot 在下一局也不会立即恢复
+        self.breakers = {player: CircuitBreaker() for player in agents}
+        self.hedge_config = dict(HEDGE_CONFIG)
+        self.latencies = {}  # bot_id -> 最近成功对话的耗时(秒)，对冲和并发请求的发出顺序都据此判断
+        self.profile_path = None  # 耗时记录的保存文件，为 None 时不保存
+        self.hedge_stats = {"eligible": 0, "hedged": 0, "won": 0}
+        self.stats_lock = threading.Lock()
+        self._hedge_executor = None
+        
+    def log(self, message):
+        """记录游戏日志"""
+        if self.echo:
+            print(message)
+        self.signals.update_log.emit(message)
+        
+    def update_status(self, status):
+        """更新游戏状态"""
+        self.signals.update_status.emit(status)
+        
+    def update_player_status(self, player_key, status, message=""):
+        """更新玩家状态"""
+        self.signals.update_player_status.emit(player_key, status, message)
+        
+    def send_message_to_agent(self, agent_key, message, wait_ack=True, phase=None, stateless=False):
+        """向指定智能体发送消息并获取回复，phase 指定使用哪个环节的时间预算，stateless 时发到新会话"""
+        agent = self.agents[agent_key]
+        # 后台分发词语时，同一会话中的下一次请求要等词语确认完成
+        if wait_ack:
+            self.wait_for_ack(agent_key)
+        route = self.route(agent_key, message, phase, stateless)
+        if route is None:
+            return self.local_reply(agent_key, phase)
+        bot_id, message, options = route
+        self.update_player_status(agent_key, "thinking")
+        request = self.begin_request(agent_key, phase)
+        
+        # 流式输出时把已生成的部分内容实时推送到界面
+        def on_delta(partial):
+            if not self.is_cut_off(request):
+                self.update_player_status(agent_key, "thinking", partial)
+        
+        try:
+            self.log(f"正在向 {agent['name']} 发送请求...")
+            answer = self.chat_with_retry(agent_key, bot_id, message, phase, options, on_delta, request)
+        except Exception as e:
+            # 结果已确定后被主动取消的请求不计入熔断器
+            if self.is_cut_off(request):
+                return None
+            self.record_outcome(agent_key, bot_id, False)
+            return self.handle_reply(agent_key, error=e, phase=phase)
+        finally:
+            self.finish_request(request)
+        # 被截止的请求不计入熔断器，也不再更新玩家状态(出局玩家的卡片保持已淘汰)
+        if self.is_cut_off(request):
+            return answer
+        self.record_outcome(agent_key, bot_id, bool(answer))
+        return self.handle_reply(agent_key, answer)
+    
+    def submit_message_to_agent(self, agent_key, message, phase=None, stateless=False):
+        """send_message_to_agent 的非阻塞版本(仅轮询方式)
+
+        对话交给客户端的集中轮询器等待完成，返回以回复(失败时为 None)为结果的 Future。
+        """
+        agent = self.agents[agent_key]
+        self.wait_for_ack(agent_key)
+        reply = Future()
+        route = self.route(agent_key, message, phase, stateless)
+        if route is None:
+            settle(reply, self.local_reply(agent_key, phase))
+            return reply
+        bot_id, message, options = route
+        self.update_player_status(agent_key, "thinking")
+        self.log(f"正在向 {agent['name']} 发送请求...")
+        deadline = self.deadline_for(phase)
+        request = self.begin_request(agent_key, phase)
+        current = {"chat": None, "attempt": 1, "start": 0.0}
+        
+        def submit():
+            if reply.done():
+                return
+            current["start"] = time.monotonic()
+            chat = self.client.submit_chat(bot_id, agent["user_id"], message, deadline=deadline,
+                                           **self.attempt_options(agent_key, bot_id, options, request))
+            current["chat"] = chat
+            chat.add_done_callback(on_done)
+        
+        def on_done(f):
+            if f.cancelled():
+                reply.cancel()
+                return
+            error = f.exception()
+            # 结果已确定后被主动取消的请求不计入熔断器，也不重试
+            if error is not None and self.is_cut_off(request):
+                settle(reply, None)
+                return
+            if error is not None:
+                delay = self.retry_policy.next_delay(error, current["attempt"], deadline)
+                if delay is not None and not reply.done():
+                    current["attempt"] += 1
+                    self.record_retry(agent_key, error, delay)
+                    self.abandon_chats(request)
+                    threading.Timer(delay, submit).start()
+                    return
+                self.record_outcome(agent_key, bot_id, False)
+                settle(reply, self.handle_reply(agent_key, error=error, phase=phase))
+            else:
+                self.record_latency(bot_id, time.monotonic() - current["start"])
+                if self.is_cut_off(request):
+                    settle(reply, f.result())
+                    return
+                self.record_outcome(agent_key, bot_id, bool(f.result()))
+                settle(reply, self.handle_reply(agent_key, f.result()))
+        
+        submit()
+        # 调用方超时放弃时一并取消底层对话的轮询
+        reply.add_done_callback(lambda f: f.cancelled() and current["chat"].cancel())
+        reply.add_done_callback(lambda f: self.finish_request(request))
+        return reply
+    
+    def attempt_options(self, agent_key, bot_id, options, request):
+        """每次尝试的会话参数：发到本局会话的请求重新读取，前一次失败前可能已经建立了本局会话；
+        本次尝试创建的对话记入请求，结果确定后据此取消"""
+        if "conversation_id" in options:
+            options = self.conversation_options(agent_key)
+        return dict(options, on_created=self.track_chat(request, options.get("on_created")))
+    
+    def abandon_chats(self, request):
+        """重新发起对话前取消上一次尝试创建的对话
+
+        查询失败已在客户端中重新查询，到这里的失败可能仍有对话在服务端进行(例如事件流中断)，
+        不取消的话同一会话中会同时有两个对话。
+        """
+        with self.stats_lock:
+            chats, request["chats"] = request["chats"], []
+        for data in chats:
+            self.cancel_chat(data)
+    
+    def track_chat(self, request, on_created=None):
+        """对话创建时记入请求，请求已被截止时立即取消该对话"""
+        def created(data):
+            with self.stats_lock:
+                request["chats"].append(data)
+                cut_off = request["cut_off"]
+            if on_created:
+                on_created(data)
+            # 对话创建前结果已经确定
+            if cut_off:
+                self.cancel_chat(data)
+        
+        return created
+    
+    def begin_request(self, agent_key, phase):
+        """登记一次在途请求，返回的请求记录由 finish_request 移除"""
+        request = {"player": agent_key, "phase": phase, "chats": [], "cut_off": False}
+        with self.stats_lock:
+            self.in_flight[id(request)] = request
+        return request
+    
+    def finish_request(self, request):
+        """请求结束，从在途请求表中移除"""
+        with self.stats_lock:
+            self.in_flight.pop(id(request), None)
+    
+    def is_cut_off(self, request):
+        """该请求的回复是否已不再需要"""
+        with self.stats_lock:
+            return request["cut_off"]
+    
+    def cut_off(self, players, phase):
+        """结果已确定：不再需要这些玩家在该环节的回复，取消他们仍在进行的对话
+
+        截止标记在请求自己身上，直到请求结束都有效，不受之后轮次的影响。
+        """
+        with self.stats_lock:
+            requests = [request for request in self.in_flight.values()
+                        if request["player"] in players and request["phase"] == phase]
+            for request in requests:
+                request["cut_off"] = True
+            chats = [data for request in requests for data in request["chats"]]
+        for data in chats:
+            self.cancel_chat(data)
+        for player in {request["player"] for request in requests}:
+            if player in self.players_alive:
+                self.update_player_status(player, "normal")
+    
+    def record_retry(self, agent_key, error, delay):
+        """记录一次重试"""
+        kind = classify_error(error)
+        with self.stats_lock:
+            self.retries[kind] = self.retries.get(kind, 0) + 1
+        self.log(f"{self.agents[agent_key]['name']} 请求失败({kind}: {str(error)})，{delay:.1f} 秒后重试")
+    
+    def chat_with_retry(self, agent_key, bot_id, message, phase, options, on_delta, request):
+        """发起对话，可重试的错误在本次请求的截止时间内退避后重试"""
+        deadline = self.deadline_for(phase)
+        for attempt in itertools.count(1):
+            try:
+                return self.hedged_chat(agent_key, bot_id, message, phase, deadline,
+                                        self.attempt_options(agent_key, bot_id, options, request), on_delta, request)
+            except Exception as e:
+                delay = self.retry_policy.next_delay(e, attempt, deadline)
+                if delay is None or self.is_cut_off(request):
+                    raise
+                self.record_retry(agent_key, e, delay)
+                self.abandon_chats(request)
+                time.sleep(delay)
+    
+    @property
+    def hedge_executor(self):
+        """对冲请求使用的线程池，与 ask_players 的线程池分开，避免互相等待"""
+        with self.stats_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=2 * self.concurrency["max_workers"])
+            return self._hedge_executor
+    
+    def record_latency(self, bot_id, elapsed):
+        """记录一次成功对话的耗时"""
+        with self.stats_lock:
+            samples = self.latencies.setdefault(bot_id, deque(maxlen=self.hedge_config["window"]))
+            samples.append(elapsed)
+    
+    def latency_profile(self, bot_id):
+        """该 bot 近期耗时的汇总，没有样本时返回 None"""
+        with self.stats_lock:
+            samples = sorted(self.latencies.get(bot_id, ()))
+        if not samples:
+            return None
+        return {
+            "count": len(samples),
+            "mean": sum(samples) / len(samples),
+            "p50": samples[(len(samples) - 1) // 2],
+            "p90": samples[max(-(-90 * len(samples) // 100) - 1, 0)]
+        }
+    
+    def latency_profiles(self):
+        """所有 bot 的近期耗时汇总 {bot_id: 汇总}"""
+        with self.stats_lock:
+            bot_ids = list(self.latencies)
+        return {bot_id: self.latency_profile(bot_id) for bot_id in bot_ids if self.latencies[bot_id]}
+    
+    def load_latency_profiles(self, path):
+        """读取之前保存的耗时记录，之后每局结束时写回同一文件"""
+        self.profile_path = path
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log(f"读取耗时记录失败: {str(e)}")
+            return
+        if not isinstance(saved, dict):
+            self.log("读取耗时记录失败: 文件格式不正确")
+            return
+        for bot_id, profile in saved.items():
+            # 格式不正确的记录跳过，不影响其他 bot
+            try:
+                samples = deque((float(sample) for sample in profile["samples"]), maxlen=self.hedge_config["window"])
+            except (KeyError, TypeError, ValueError) as e:
+                self.log(f"跳过格式不正确的耗时记录 {bot_id}: {str(e)}")
+                continue
+            with self.stats_lock:
+                self.latencies[bot_id] = samples
+    
+    def save_latency_profiles(self):
+        """把各 bot 的耗时记录写入文件(先写临时文件再替换，避免中途退出留下不完整的文件)"""
+        if not self.profile_path:
+            return
+        with self.stats_lock:
+            saved = {bot_id: list(samples) for bot_id, samples in self.latencies.items() if samples}
+        saved = {bot_id: dict(self.latency_profile(bot_id), samples=samples) for bot_id, samples in saved.items()}
+        try:
+            with open(self.profile_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(saved, f, ensure_ascii=False, indent=2)
+            os.replace(self.profile_path + ".tmp", self.profile_path)
+        except OSError as e:
+            self.log(f"保存耗时记录失败: {str(e)}")
+    
+    def dispatch_order(self, players):
+        """并发请求的发出顺序：近期平均耗时长的先发，没有样本的视为最慢，耗时相同时保持座次"""
+        if not self.concurrency["longest_first"]:
+            return list(players)
+        
+        def expected(player):
+            profile = self.latency_profile(self.agents[player]["bot_id"])
+            return -profile["mean"] if profile else float("-inf")
+        
+        return sorted(players, key=expected)
+    
+    def hedge_delay(self, bot_id, phase, deadline):
+        """等待多久后发出对冲请求，不对冲时返回 None"""
+        cfg = self.hedge_config
+        if not cfg["enabled"] or phase not in cfg["phases"]:
+            return None
+        with self.stats_lock:
+            samples = sorted(self.latencies.get(bot_id, ()))
+        if len(samples) < cfg["min_samples"]:
+            return None
+        delay = samples[max(-(-cfg["quantile"] * len(samples) // 100) - 1, 0)]
+        return delay if deadline is not None and delay < deadline.remaining() else None
+    
+    def allow_hedge(self):
+        """对冲请求数不超过可对冲请求数的 max_rate"""
+        with self.stats_lock:
+            if self.hedge_stats["hedged"] + 1 > self.hedge_config["max_rate"] * self.hedge_stats["eligible"]:
+                return False
+            self.hedge_stats["hedged"] += 1
+            return True
+    
+    def cancel_chat(self, data):
+        """在后台取消一个已经不需要的对话，失败时忽略"""
+        def cancel():
+            try:
+                self.client.cancel_chat(data["conversation_id"], data["id"], data.get("bot_id"))
+            except Exception as e:
+                self.log(f"取消对话失败: {str(e)}")
+        self.hedge_executor.submit(cancel)
+    
+    def hedge_message(self, agent_key, message, phase):
+        """对冲请求在新会话中发出，描述请求要带上词语"""
+        if phase == "description":
+            return self.description_message(agent_key, with_word=True)
+        return message
+    
+    def hedge_callbacks(self, name, winner, chats, on_created=None, on_delta=None):
+        """对冲中一路请求的回调：记录创建的对话，另一路已经完成时取消自己"""
+        def created(data):
+            chats[name] = data
+            if on_created:
+                on_created(data)
+            # 对话创建前另一路已经完成
+            if winner and winner[0] != name:
+                self.cancel_chat(data)
+        
+        def partial(text):
+            # 另一路已经完成，抛出异常以停止接收事件流
+            if winner and winner[0] != name:
+                raise CozeError("对冲请求已结束")
+            if on_delta:
+                on_delta(text)
+        
+        return created, partial
+    
+    def finish_hedge(self, name, winner, chats):
+        """一路请求先拿到回答：取消另一路的对话并记录统计"""
+        winner.append(name)
+        loser = "hedge" if name == "primary" else "primary"
+        if loser in chats:
+            self.cancel_chat(chats[loser])
+        if name == "hedge":
+            with self.stats_lock:
+                self.hedge_stats["won"] += 1
+    
+    def hedged_chat(self, agent_key, bot_id, message, phase, deadline, options, on_delta, request):
+        """发起对话；超过该 bot 近期耗时的高分位仍未完成时发出一次对冲请求，取先完成的结果
+
+        两路请求创建的对话都记入 request，请求被截止时一并取消。
+        """
+        user_id = self.agents[agent_key]["user_id"]
+        delay = self.hedge_delay(bot_id, phase, deadline)
+        if delay is None:
+            start = time.monotonic()
+            answer = self.client.chat(bot_id, user_id, message, on_delta=on_delta, deadline=deadline, **options)
+            self.record_latency(bot_id, time.monotonic() - start)
+            return answer
+        
+        with self.stats_lock:
+            self.hedge_stats["eligible"] += 1
+        winner = []
+        chats = {}
+        
+        def attempt(name, message, conversation_id=None, on_created=None, on_delta=None):
+            created, partial = self.hedge_callbacks(name, winner, chats, on_created, on_delta)
+            start = time.monotonic()
+            answer = self.client.chat(bot_id, user_id, message, on_delta=partial, conversation_id=conversation_id,
+                                      on_created=created, deadline=deadline)
+            self.record_latency(bot_id, time.monotonic() - start)
+            return answer
+        
+        primary = self.hedge_executor.submit(attempt, "primary", message, on_delta=on_delta, **options)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        if not self.allow_hedge():
+            return primary.result()
+        
+        self.log(f"{self.agents[agent_key]['name']} 超过 {delay:.1f} 秒未完成，发出对冲请求")
+        hedge = self.hedge_executor.submit(attempt, "hedge", self.hedge_message(agent_key, message, phase),
+                                           on_created=self.track_chat(request))
+        names = {primary: "primary", hedge: "hedge"}
+        pending = {primary, hedge}
+        error = None
+        answer = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                answer = future.result()
+                if answer:
+                    self.finish_hedge(names[future], winner, chats)
+                    return answer
+        if error is not None and not answer:
+            raise error
+        return answer
+    
+    def route(self, agent_key, message, phase, stateless=False):
+        """根据熔断器状态决定本次请求发给谁，返回 (bot_id, 消息, 会话参数)，需要本地兜底时返回 None"""
+        agent = self.agents[agent_key]
+        if self.breakers[agent_key].allow():
+            return agent["bot_id"], message, {} if stateless else self.conversation_options(agent_key)
+        standby = agent.get("standby_bot_id")
+        if not standby:
+            return None
+        # 备用 bot 没有本局的会话历史，每次新建会话，描述请求要重新带上词语
+        if phase == "description":
+            message = self.description_message(agent_key, with_word=True)
+        self.log(f"{agent['name']} 已熔断，改用备用智能体")
+        return standby, message, {}
+    
+    def record_outcome(self, agent_key, bot_id, success):
+        """把主 bot 的请求结果记入熔断器，备用 bot 的结果不计入"""
+        if bot_id != self.agents[agent_key]["bot_id"]:
+            return
+        if self.breakers[agent_key].record(success):
+            self.log(f"{self.agents[agent_key]['name']} 连续请求失败，暂停向其发送请求，"
+                     f"{self.breakers[agent_key].config['reset_timeout']} 秒后再试探")
+    
+    def local_reply(self, agent_key, phase):
+        """熔断且没有备用 bot 时的本地兜底：描述给出一句泛泛的话，投票返回 None 按随机投票处理"""
+        self.log(f"{self.agents[agent_key]['name']} 已熔断，使用本地兜底回复")
+        if phase == "description":
+            answer = random.choice(FALLBACK_DESCRIPTIONS)
+        elif phase == "init":
+            answer = "好的，我记住了。"
+        else:
+            self.update_player_status(agent_key, "error", "已熔断")
+            return None
+        self.update_player_status(agent_key, "normal", answer)
+        return answer
+    
+    def handle_reply(self, agent_key, answer=None, error=None, phase=None):
+        """根据回复或异常更新玩家状态，返回有效回复，失败时返回 None；已出局的玩家不再更新状态"""
+        agent = self.agents[agent_key]
+        
+        def status(state, message=""):
+            if agent_key in self.players_alive:
+                self.update_player_status(agent_key, state, message)
+        
+        if isinstance(error, CozeTimeout):
+            self.log(f"{agent['name']} 超过截止时间未回复: {str(error)}")
+            self.record_timeout(agent_key, phase)
+            return None
+        if isinstance(error, CozeError):
+            self.log(f"错误信息: {str(error)}")
+            status("error", "API错误")
+            return None
+        if error is not None:
+            self.log(f"与智能体 {agent['name']} 通信时出错: {str(error)}")
+            status("error", str(error))
+            return None
+        if not answer:
+            status("error", "请求失败")
+            return None
+        
+        status("normal", answer)
+        return answer
+    
+    def deadline_for(self, phase):
+        """按环节的时间预算生成请求的截止时间，未指定环节时使用客户端的默认值"""
+        return Deadline(self.budgets[phase]) if phase else None
+    
+    def record_timeout(self, agent_key, phase):
+        """记录一次超时，并把仍存活的玩家状态标记为超时"""
+        if phase:
+            with self.timeouts_lock:
+                self.timeouts[phase] = self.timeouts.get(phase, 0) + 1
+        if agent_key in self.players_alive:
+            self.update_player_status(agent_key, "error", "超时")
+    
+    def wait_for_ack(self, agent_key):
+        """等待该玩家在后台进行的词语确认请求结束"""
+        future = self.pending_acks.pop(agent_key, None)
+        if future is None:
+            return
+        try:
+            future.result(timeout=self.budgets["init"] + DEADLINE_GRACE)
+        except FutureTimeoutError:
+            self.log(f"{self.agents[agent_key]['name']} 确认词语超时")
+    
+    def conversation_options(self, agent_key):
+        """发起对话时的会话参数：复用会话时发到本局已建立的会话，首次对话后记下新会话"""
+        if not self.game_config["reuse_conversation"]:
+            return {}
+        
+        # 记到发起请求时这一局的会话表中，上一局遗留的后台请求不会影响新的一局
+        conversations = self.conversations
+        
+        def on_created(data):
+            conversations.setdefault(agent_key, data["conversation_id"])
+        
+        return {"conversation_id": conversations.get(agent_key), "on_created": on_created}
+    
+    def word_for(self, player):
+        """返回玩家拿到的词语"""
+        return self.current_theme["minority"] if player == self.undercover else self.current_theme["majority"]
+    
+    def ask_players(self, players, messages, phase, stateless=False, until=None):
+        """并发向多个玩家发送消息，按座次返回 {玩家: 回复}，超过该环节时间预算的玩家记为 None
+
+        until(玩家, 回复) 按回复到达的顺序调用，返回 True 时取消其余玩家的请求，他们不出现在结果中。
+        """
+        # 轮询方式下可以交给集中轮询器，等待期间不占用线程
+        if self.concurrency["multiplex"] and not self.client.stream:
+            futures = {player: self.submit_message_to_agent(player, messages[player], phase, stateless)
+                       for player in self.dispatch_order(players)}
+        else:
+            futures = {player: self.executor.submit(self.send_message_to_agent, player, messages[player], True, phase,
+                                                    stateless)
+                       for player in self.dispatch_order(players)}
+        # 请求本身会在截止时间结束，这里只兜底仍在排队或卡住的请求
+        timeout = self.budgets[phase]
+        deadline = time.monotonic() + timeout + DEADLINE_GRACE
+        owners = {future: player for player, future in futures.items()}
+        pending = set(owners)
+        replies = {}
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            stop = False
+            for future in done:
+                player = owners[future]
+                replies[player] = future.result()
+                stop = stop or (until is not None and until(player, replies[player]))
+            if stop and pending:
+                # 排队中的请求直接取消，已在执行的请求取消其对话
+                rest = [owners[future] for future in pending]
+                self.cut_off(rest, phase)
+                for future in pending:
+                    future.cancel()
+                return {player: replies[player] for player in players if player in replies}
+        for future in pending:
+            player = owners[future]
+            # 已在执行的请求无法取消，由它自己到截止时间后记录超时
+            if future.cancel():
+                self.record_timeout(player, phase)
+            self.log(f"{self.agents[player]['name']} 超过 {timeout} 秒未回复")
+            replies[player] = None
+        return {player: replies[player] for player in players}
+    
+    def start_new_game(self):
+        """重置游戏状态，随机选择主题和卧底"""
+        self.round = 0
+        self.players_alive = list(self.agents.keys())
+        self.eliminated_players = []
+        self.game_history = []
+        self.conversations = {}
+        self.pending_acks = {}
+        self.discard_prefetched()
+        # 客户端为会话保存的本地状态(其他提供方的会话历史、多密钥时会话的归属)随本局会话一起丢弃
+        self.client.reset_conversations()
+        self.timeouts = {phase: 0 for phase in self.budgets}
+        self.retries = {}
+        self.skipped_votes = 0
+        
+        self.update_status("初始化游戏...")
+        
+        # 随机选择一个主题
+        self.current_theme = random.choice(self.game_themes)
+        
+        # 随机选择一个卧底
+        self.undercover = random.choice(self.players_alive)
+        
+        # 初始化所有玩家状态
+        for player in self.agents:
+            self.update_player_status(player, "normal")
+    
+    def word_messages(self):
+        """构造开局时发给每个玩家的词语消息"""
+        messages = {}
+        for player in self.players_alive:
+            word = self.word_for(player)
+            messages[player] = f"游戏开始！你是: {self.agents[player]['name']} 你的词语是: {word}。请记住这个词语，不用给出描述"
+        return messages
+    
+    def log_acknowledgement(self, player, response):
+        """记录玩家对词语的确认"""
+        if response:
+            self.log(f"{self.agents[player]['name']} 已收到词语")
+    
+    def finish_initialization(self, responses):
+        """记录词语分发结果并发出初始化完成信号，responses 为空表示没有等待玩家确认"""
+        acknowledged = []
+        for player in self.players_alive:
+            if responses and responses[player]:
+                acknowledged.append(player)
+                self.log_acknowledgement(player, responses[player])
+            
+        self.log(f"游戏初始化完成！卧底是: {self.agents[self.undercover]['name']}")
+        self.log(f"多数派词语: {self.current_theme['majority']}")
+        self.log(f"卧底词语: {self.current_theme['minority']}")
+        
+        self.update_status("游戏已初始化")
+        
+        # 所有玩家都已应答(或超时，或无需等待)，通知界面可以开始第一轮
+        self.signals.initialized.emit({"acknowledged": acknowledged})
+    
+    def initialize_game(self):
+        """初始化游戏，分配词语"""
+        self.start_new_game()
+        init_mode = self.game_config["init_mode"]
+        
+        # 词语随第一轮描述请求发出，不需要单独的确认环节
+        if init_mode == "skip":
+            self.finish_initialization(None)
+            return
+        
+        messages = self.word_messages()
+        
+        # 后台发送词语，第一轮中每个玩家的请求会先等待自己的确认完成
+        if init_mode == "async":
+            for player in self.players_alive:
+                future = self.executor.submit(self.send_message_to_agent, player, messages[player], False, "init")
+                future.add_done_callback(
+                    lambda f, player=player: self.log_acknowledgement(player, None if f.exception() else f.result()))
+                self.pending_acks[player] = future
+            self.finish_initialization(None)
+            return
+        
+        # 向玩家发送他们的词语，并发模式下同时分发给所有玩家
+        if self.concurrency["init"]:
+            responses = self.ask_players(self.players_alive, messages, "init")
+        else:
+            responses = {player: self.send_message_to_agent(player, messages[player], phase="init")
+                         for player in self.players_alive}
+        
+        self.finish_initialization(responses)
+    
+    def start_round(self):
+        """进入下一轮"""
+        self.round += 1
+        self.log(f"\n====== 第 {self.round} 轮 ======")
+        self.update_status(f"第 {self.round} 轮")
+    
+    def description_message(self, player, with_word=False):
+        """构造发给一个玩家的描述请求，已在本局会话中收到过词语的玩家不必重复发送；
+        需要带上词语时同时告知玩家自己是谁(投票请求中没有填入名字，不知道名字就无法避免投给自己)"""
+        if player in self.conversations and not with_word:
+            return "请根据你的词语进行一句话描述，不要直接说出这个词。"
+        word = self.word_for(player)
+        return f"你是: {self.agents[player]['name']} 你的词语是: {word}。请根据你的词语进行一句话描述，不要直接说出这个词。"
+    
+    def description_messages(self):
+        """构造本轮发给每个玩家的描述请求"""
+        return {player: self.description_message(player) for player in self.players_alive}
+    
+    def record_description(self, round_responses, player, description):
+        """记录一个玩家本轮的描述"""
+        if description:
+            round_responses[player] = description
+            self.log(f"{self.agents[player]['name']} 描述: {description}")
+        else:
+            round_responses[player] = "无法获取有效回复"
+            self.log(f"{self.agents[player]['name']} 无法获取有效回复")
+    
+    def complete_descriptions(self, round_responses):
+        """保存本轮描述并发出轮次完成信号"""
+        # 记录本轮历史
+        self.game_history.append(round_responses)
+        
+        # 发送轮次完成信号
+        self.signals.round_complete.emit({
+            "round": self.round,
+            "responses": round_responses
+        })
+    
+    def play_round(self):
+        """进行一轮游戏"""
+        self.start_round()
+        
+        round_responses = {}
+        messages = self.description_messages()
+        
+        # 流水线模式下上一轮结束时已经发出了本轮的描述请求
+        prefetched = self.take_prefetched()
+        # 并发模式下同时发出所有描述请求，之后仍按座次记录
+        if prefetched is None and self.concurrency["descriptions"]:
+            prefetched = self.ask_players(self.players_alive, messages, "description")
+        
+        # 每个玩家描述词语
+        for player in self.players_alive:
+            if prefetched is not None:
+                description = prefetched[player]
+            else:
+                description = self.send_message_to_agent(player, messages[player], phase="description")
+            self.record_description(round_responses, player, description)
+        
+        self.complete_descriptions(round_responses)
+        
+        # 推测模式下投票期间就发出下一轮的描述请求，本轮之后游戏必定结束时不发
+        if self.game_config["speculative_descriptions"] and not self.final_round():
+            self.prefetch_descriptions(stateless=True)
+        
+        # 让每个玩家投票
+        votes = self.conduct_voting()
+        
+        # 处理投票结果
+        self.process_votes(votes)
+        
+        # 检查游戏是否结束
+        game_over = self.check_game_over()
+        self.finish_round(game_over)
+        return game_over
+    
+    def finish_round(self, game_over):
+        """一轮结束：游戏结束时保存耗时记录，流水线模式下立即发出下一轮的描述请求(推测模式已提前发出时不再重复)，然后通知界面"""
+        if game_over:
+            self.discard_prefetched()
+            self.save_latency_profiles()
+        elif self.game_config["pipeline_rounds"] and self.prefetched is None:
+            self.prefetch_descriptions()
+        self.signals.round_finished.emit({"round": self.round, "game_over": game_over})
+    
+    def collect_descriptions(self, players, messages, stateless=False):
+        """获取一组玩家的描述，并发模式下同时请求"""
+        if self.concurrency["descriptions"]:
+            return self.ask_players(players, messages, "description", stateless)
+        return {player: self.send_message_to_agent(player, messages[player], phase="description", stateless=stateless)
+                for player in players}
+    
+    def speculative_messages(self):
+        """推测请求发到新会话，每个玩家的描述请求都要带上词语"""
+        return {player: self.description_message(player, with_word=True) for player in self.players_alive}
+    
+    def prefetch_descriptions(self, stateless=False):
+        """在后台提前发出下一轮的描述请求，stateless 时发到新会话，可以与本局会话中的请求同时进行"""
+        messages = self.speculative_messages() if stateless else self.description_messages()
+        players = list(self.players_alive)
+        future = Future()
+        
+        # 汇总结果的线程不占用请求线程池，推测请求与投票同时进行时线程池只需容纳两组请求
+        def collect():
+            try:
+                settle(future, self.collect_descriptions(players, messages, stateless))
+            except Exception as e:
+                settle(future, error=e)
+        
+        threading.Thread(target=collect, daemon=True).start()
+        self.prefetched = future
+    
+    def take_prefetched(self):
+        """取出提前发出的描述请求的结果，只保留仍存活的玩家，没有时返回 None"""
+        future, self.prefetched = self.prefetched, None
+        if future is None:
+            return None
+        descriptions = future.result()
+        return {player: descriptions.get(player) for player in self.players_alive}
+    
+    def discard_prefetched(self):
+        """放弃尚未使用的提前请求(例如游戏结束或开始新的一局)，取消其中仍在进行的对话"""
+        future, self.prefetched = self.prefetched, None
+        if future is not None:
+            future.cancel()
+            self.cut_off(list(self.agents), "description")
+    
+    def vote_prompt(self):
+        """根据上一轮描述构建投票信息"""
+        vote_info = "你是: {self.agents[player]['name']}，请不要投票给自己，请根据以下描述，投票选出你认为是卧底的玩家(输入对应数字)，但请不要投给自己:\n"
+        for i, player in enumerate(self.players_alive, 1):
+            last_description = self.game_history[-1][player]
+            vote_info += f"{i}. {self.agents[player]['name']}: {last_description}\n"
+        return vote_info
+    
+    def parse_vote(self, player, vote_text):
+        """从玩家的回复中解析投票对象，无法解析时随机投票"""
+        if vote_text:
+            # 尝试从回复中提取数字
+            try:
+                # 简单处理：查找第一个数字
+                for char in vote_text:
+                    if char.isdigit() and 1 <= int(char) <= len(self.players_alive):
+                        vote_num = int(char)
+                        voted_player = self.players_alive[vote_num - 1]
+                        self.log(f"{self.agents[player]['name']} 投票给了 {self.agents[voted_player]['name']}")
+                        return voted_player
+                else:
+                    # 如果没找到有效数字，随机投票
+                    voted_player = random.choice([p for p in self.players_alive if p != player])
+                    self.log(f"{self.agents[player]['name']} 投票无效，系统随机分配给了 {self.agents[voted_player]['name']}")
+                    return voted_player
+            except Exception as e:
+                # 出错也随机投票
+                self.log(f"处理投票时出错: {str(e)}")
+                voted_player = random.choice([p for p in self.players_alive if p != player])
+                self.log(f"{self.agents[player]['name']} 投票处理出错，系统随机分配给了 {self.agents[voted_player]['name']}")
+                return voted_player
+        else:
+            # 响应出错也随机投票
+            voted_player = random.choice([p for p in self.players_alive if p != player])
+            self.log(f"{self.agents[player]['name']} 无法获取投票，系统随机分配给了 {self.agents[voted_player]['name']}")
+            return voted_player
+    
+    def conduct_voting(self):
+        """进行投票"""
+        votes = {}
+        self.update_status("投票中...")
+        
+        # 构建投票信息
+        vote_info = self.vote_prompt()
+        
+        # 每收到一票就计入，淘汰结果确定后不再等待其余投票
+        tally = VoteTally(self.players_alive)
+        
+        def count(player, vote_text):
+            votes[player] = self.parse_vote(player, vote_text)
+            tally.add(votes[player])
+            return self.game_config["vote_cutoff"] and tally.decided() is not None
+        
+        # 并发模式下同时发出所有投票请求，按到达顺序计票，超时的玩家按无法获取投票处理
+        if self.concurrency["votes"]:
+            messages = {player: vote_info for player in self.players_alive}
+            replies = self.ask_players(self.players_alive, messages, "vote", until=count)
+            for player, vote_text in replies.items():
+                if player not in votes:
+                    count(player, vote_text)
+        else:
+            # 收集每个玩家的投票
+            for player in self.players_alive:
+                message = vote_info
+                if count(player, self.send_message_to_agent(player, message, phase="vote")):
+                    break
+        
+        self.log_skipped_votes(votes)
+        return votes
+    
+    def log_skipped_votes(self, votes):
+        """记录因淘汰结果已确定而没有等待的投票"""
+        skipped = [player for player in self.players_alive if player not in votes]
+        if not skipped:
+            return
+        self.skipped_votes += len(skipped)
+        names = "、".join(self.agents[player]["name"] for player in skipped)
+        self.log(f"淘汰结果已确定，不再等待 {names} 的投票")
+    
+    def process_votes(self, votes):
+        """处理投票结果"""
+        # 统计每个玩家获得的票数
+        vote_count = {}
+        for player in self.players_alive:
+            vote_count[player] = 0
+            
+        for voter, voted in votes.items():
+            vote_count[voted] += 1
+        
+        # 找出得票最多的玩家
+        max_votes = max(vote_count.values())
+        most_voted = [player for player, count in vote_count.items() if count == max_votes]
+        
+        # 如果有平票，随机选择一个
+        eliminated = random.choice(most_voted)
+        
+        # 输出投票结果
+        self.log("\n投票结果:")
+        for player in self.players_alive:
+            self.log(f"{self.agents[player]['name']}: {vote_count[player]} 票")
+        
+        # 移除被淘汰的玩家，推测模式下已为他发出的下一轮描述请求不再需要
+        self.players_alive.remove(eliminated)
+        self.eliminated_players.append(eliminated)
+        self.cut_off([eliminated], "description")
+        
+        self.log(f"\n{self.agents[eliminated]['name']} 被淘汰了！")
+        is_undercover = (eliminated == self.undercover)
+        if is_undercover:
+            self.log("卧底被淘汰了！")
+        else:
+            self.log("平民被淘汰了！")
+            
+        # 发送玩家淘汰信号
+        self.signals.player_eliminated.emit(eliminated, is_undercover)
+        
+        self.update_player_status(eliminated, "eliminated")
+    
+    def winner(self):
+        """按当前局面判断胜负，尚未分出胜负时返回 None"""
+        # 如果卧底已被淘汰，平民获胜
+        if self.undercover in self.eliminated_players:
+            return "平民"
+        # 如果只剩下卧底和一个平民，卧底获胜
+        if len(self.players_alive) <= 2:
+            return "卧底"
+        return None
+    
+    def final_round(self):
+        """本轮无论淘汰谁游戏都会结束：只剩三人时淘汰卧底则平民获胜，否则只剩两人卧底获胜"""
+        return len(self.players_alive) <= 3
+    
+    def check_game_over(self):
+        """检查游戏是否结束"""
+        winner = self.winner()
+        game_over = winner is not None
+        
+        if game_over:
+            self.log(f"\n游戏结束！{winner}获胜！")
+            # 发送游戏结束信号
+            self.signals.game_over.emit({
+                "undercover": self.agents[self.undercover]['name'],
+                "winner": winner,
+                "rounds": self.round,
+                "theme": self.current_theme
+            })
+            self.update_status(f"游戏结束 - {winner}获胜")
+            
+        return game_over
+    
+    def run_game(self):
+        """运行完整游戏"""
+        self.initialize_game()
+        
+        game_over = False
+        while not game_over:
+            game_over = self.play_round()
+            if not game_over and self.round_pause:
+                time.sleep(self.round_pause)  # 暂停几秒，便于阅读
+        
+        return self.game_result()
+    
+    def game_result(self):
+        """输出并返回游戏结果"""
+        # 游戏结束，显示结果
+        self.log("\n====== 游戏结果 ======")
+        self.log(f"卧底是: {self.agents[self.undercover]['name']}")
+        self.log(f"卧底词语: {self.current_theme['minority']}")
+        self.log(f"多数派词语: {self.current_theme['majority']}")
+        
+        return {
+            "undercover": self.agents[self.undercover]['name'],
+            "winner": "平民" if self.undercover in self.eliminated_players else "卧底",
+            "rounds": self.round,
+            "theme": self.current_theme,
+            "timeouts": dict(self.timeouts),
+            "retries": dict(self.retries),
+            "skipped_votes": self.skipped_votes
+        }
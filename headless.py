@@ -0,0 +1,162 @@
+"""无界面运行入口
+
+批量模拟: python -m headless simulate --games 100 --workers 4 --output simulation.json
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from game import AGENTS, GAME_THEMES, WhoIsUndercoverGame
+from providers import with_provider
+
+# 每个工作进程复用同一个游戏对象及其连接池
+worker_game = None
+
+
+def init_worker(concurrency, provider=None, config=None):
+    """工作进程初始化：创建不依赖界面的游戏对象，provider 不为空时所有智能体改用该提供方，config 覆盖游戏配置"""
+    global worker_game
+    agents = with_provider(AGENTS, provider) if provider else AGENTS
+    worker_game = WhoIsUndercoverGame(agents, GAME_THEMES, config=config, concurrency=concurrency)
+    worker_game.echo = False
+    worker_game.round_pause = 0
+
+
+def play_one(seed):
+    """在工作进程中完整进行一局游戏，返回本局的统计数据"""
+    random.seed(seed)
+    game = worker_game
+    start = time.monotonic()
+    result = game.run_game()
+
+    # 每轮淘汰一人，淘汰顺序即淘汰轮次
+    eliminated_round = {player: index for index, player in enumerate(game.eliminated_players, 1)}
+    players = {}
+    for player in game.agents:
+        players[player] = {
+            "undercover": player == game.undercover,
+            "eliminated_round": eliminated_round.get(player),
+            "failed_descriptions": sum(1 for responses in game.game_history
+                                       if responses.get(player) == "无法获取有效回复")
+        }
+    return {
+        "winner": result["winner"],
+        "rounds": result["rounds"],
+        "theme": result["theme"],
+        "elapsed": time.monotonic() - start,
+        "timeouts": result["timeouts"],
+        "retries": result["retries"],
+        "players": players
+    }
+
+
+def aggregate(results):
+    """汇总多局结果：胜率、结束轮数和每个智能体的表现"""
+    games = len(results)
+    winners = {}
+    rounds = [r["rounds"] for r in results]
+    histogram = {}
+    timeouts = {}
+    retries = {}
+    for r in results:
+        winners[r["winner"]] = winners.get(r["winner"], 0) + 1
+        histogram[r["rounds"]] = histogram.get(r["rounds"], 0) + 1
+        for phase, count in r["timeouts"].items():
+            timeouts[phase] = timeouts.get(phase, 0) + count
+        for kind, count in r["retries"].items():
+            retries[kind] = retries.get(kind, 0) + count
+
+    agents = {}
+    for player, info in AGENTS.items():
+        stats = {"name": info["name"], "games": 0, "undercover_games": 0, "wins": 0,
+                 "undercover_wins": 0, "eliminated": 0, "survived_rounds": 0, "failed_descriptions": 0}
+        for r in results:
+            p = r["players"][player]
+            undercover_won = r["winner"] == "卧底"
+            won = undercover_won if p["undercover"] else not undercover_won
+            stats["games"] += 1
+            stats["undercover_games"] += p["undercover"]
+            stats["wins"] += won
+            stats["undercover_wins"] += p["undercover"] and undercover_won
+            stats["eliminated"] += p["eliminated_round"] is not None
+            stats["survived_rounds"] += p["eliminated_round"] or r["rounds"]
+            stats["failed_descriptions"] += p["failed_descriptions"]
+        stats["win_rate"] = stats["wins"] / games if games else 0
+        stats["mean_survival_rounds"] = stats.pop("survived_rounds") / games if games else 0
+        agents[player] = stats
+
+    return {
+        "games": games,
+        "winners": winners,
+        "win_rates": {winner: count / games for winner, count in winners.items()} if games else {},
+        "rounds": {
+            "mean": sum(rounds) / games if games else 0,
+            "min": min(rounds, default=0),
+            "max": max(rounds, default=0),
+            "histogram": {str(k): v for k, v in sorted(histogram.items())}
+        },
+        "mean_game_seconds": sum(r["elapsed"] for r in results) / games if games else 0,
+        "timeouts": timeouts,
+        "retries": retries,
+        "agents": agents
+    }
+
+
+def simulate(games, workers, concurrency=None, seed=None, provider=None, config=None):
+    """在进程池中运行多局游戏并汇总结果"""
+    rng = random.Random(seed)
+    seeds = [rng.randrange(2 ** 32) for _ in range(games)]
+    results = []
+    failures = 0
+    start = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(concurrency, provider, config)) as pool:
+        futures = [pool.submit(play_one, s) for s in seeds]
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failures += 1
+                print(f"第 {done} 局运行失败: {e}", file=sys.stderr)
+            if done % 10 == 0 or done == games:
+                print(f"已完成 {done}/{games} 局", file=sys.stderr)
+    elapsed = time.monotonic() - start
+
+    summary = aggregate(results)
+    summary["failed_games"] = failures
+    summary["workers"] = workers
+    summary["elapsed_seconds"] = elapsed
+    summary["games_per_hour"] = len(results) / elapsed * 3600 if elapsed else 0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m headless", description="谁是卧底无界面运行入口")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sim = commands.add_parser("simulate", help="在多个进程中批量模拟游戏")
+    sim.add_argument("--games", type=int, default=10, help="模拟的局数")
+    sim.add_argument("--workers", type=int, default=2, help="工作进程数")
+    sim.add_argument("--concurrent", action="store_true", help="描述和投票环节并发请求")
+    sim.add_argument("--provider", choices=("coze", "scripted", "embedding"), default=None,
+                     help="所有智能体改用的提供方，scripted/embedding 在进程内回答，不访问网络")
+    sim.add_argument("--vote-cutoff", action="store_true", help="淘汰结果确定后不再等待其余投票")
+    sim.add_argument("--seed", type=int, default=None, help="随机种子")
+    sim.add_argument("--output", default="simulation.json", help="结果输出文件")
+
+    args = parser.parse_args(argv)
+    if args.command == "simulate":
+        concurrency = {"descriptions": True, "votes": True} if args.concurrent else None
+        config = {"vote_cutoff": True} if args.vote_cutoff else None
+        summary = simulate(args.games, args.workers, concurrency, args.seed, args.provider, config)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(json.dumps({k: summary[k] for k in ("games", "win_rates", "rounds", "games_per_hour")},
+                         ensure_ascii=False, indent=2))
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
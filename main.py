@@ -1,68 +1,15 @@
 import sys
-import os
-import random
-import time
-import json
+import asyncio
 import threading
-import requests
-from dotenv import load_dotenv
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QPushButton, QLabel, QTextEdit, 
                             QGridLayout, QFrame, QMessageBox, QInputDialog)
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject
 from PyQt5.QtGui import QFont, QPixmap, QColor
+from game import AGENTS, GAME_THEMES, LATENCY_PROFILE_FILE, WhoIsUndercoverGame
+from async_game import AsyncWhoIsUndercoverGame
 
-# 加载环境变量
-load_dotenv()
-
-# 获取API密钥
-API_KEY = os.getenv("COZE_API_KEY")
-if not API_KEY:
-    raise ValueError("请在.env文件中设置COZE_API_KEY")
-
-# 智能体配置
-AGENTS = {
-    "agent1": {
-        "name": "谁是卧底1",
-        "bot_id": "7516937350422462500",
-        "user_id": "user1",
-        "color": "#FFB6C1"  # 浅粉色
-    },
-    "agent2": {
-        "name": "谁是卧底2",
-        "bot_id": "7516949959041105960",
-        "user_id": "user2",
-        "color": "#ADD8E6"  # 浅蓝色
-    },
-    "agent3": {
-        "name": "谁是卧底3",
-        "bot_id": "7516952335664021558",
-        "user_id": "user3",
-        "color": "#90EE90"  # 浅绿色
-    },
-    "agent4": {
-        "name": "谁是卧底4",
-        "bot_id": "7516953397153792036",
-        "user_id": "user4",
-        "color": "#FFFACD"  # 浅黄色
-    }
-}
-
-# 游戏主题配置
-GAME_THEMES = [
-    {"majority": "电脑", "minority": "笔记本"},
-    {"majority": "西瓜", "minority": "南瓜"},
-    {"majority": "足球", "minority": "篮球"},
-    {"majority": "电影", "minority": "电视剧"},
-    {"majority": "苹果", "minority": "梨"},
-    {"majority": "咖啡", "minority": "奶茶"},
-    {"majority": "微信", "minority": "QQ"},
-    {"majority": "地铁", "minority": "公交车"},
-    {"majority": "风扇", "minority": "空调"},
-    {"majority": "太阳", "minority": "月亮"}
-]
-
-# 游戏事件信号类
+# 游戏事件信号类，属性与 game.GameEvents 一致，工作线程发出的信号会自动转到界面线程
 class GameSignals(QObject):
     update_log = pyqtSignal(str)
     update_status = pyqtSignal(str)
@@ -70,326 +17,36 @@ class GameSignals(QObject):
     game_over = pyqtSignal(dict)
     player_eliminated = pyqtSignal(str, bool)  # player_key, is_undercover
     update_player_status = pyqtSignal(str, str, str)  # player_key, status, message
+    initialized = pyqtSignal(dict)  # 词语分发完成
+    round_finished = pyqtSignal(dict)  # 一轮(含投票)结束
 
-# 游戏逻辑类
-class WhoIsUndercoverGame:
-    def __init__(self, agents, game_themes):
-        self.agents = agents
-        self.game_themes = game_themes
-        self.current_theme = None
-        self.undercover = None
-        self.players_alive = list(agents.keys())
-        self.eliminated_players = []
-        self.round = 0
-        self.game_history = []
-        self.signals = GameSignals()
-        
-    def log(self, message):
-        """记录游戏日志"""
-        print(message)
-        self.signals.update_log.emit(message)
-        
-    def update_status(self, status):
-        """更新游戏状态"""
-        self.signals.update_status.emit(status)
-        
-    def update_player_status(self, player_key, status, message=""):
-        """更新玩家状态"""
-        self.signals.update_player_status.emit(player_key, status, message)
-        
-    def send_message_to_agent(self, agent_key, message):
-        """向指定智能体发送消息并获取回复"""
-        agent = self.agents[agent_key]
-        self.update_player_status(agent_key, "thinking")
-        
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # 第一步：发起对话
-        data = {
-            "bot_id": agent["bot_id"],
-            "user_id": agent["user_id"],
-            "stream": False,
-            "additional_messages": [
-                {
-                    "content": message,
-                    "content_type": "text",
-                    "role": "user",
-                    "type": "question"
-                }
-            ]
-        }
-        
-        try:
-            # 发送初始请求
-            self.log(f"正在向 {agent['name']} 发送请求...")
-            response = requests.post("https://api.coze.cn/v3/chat", headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
-            
-            # 获取conversation_id并等待对话执行完毕
-            if 'data' in result and 'conversation_id' in result['data']:
-                conversation_id = result['data']['conversation_id']
-                id = result['data']['id']
-                status = result['data'].get('status', 'unknown')
-                # 等待处理完成
-                time.sleep(5)
-                while status != "completed":
-                    time.sleep(2)
-                    url = "https://api.coze.cn/v3/chat/retrieve"
-                    params = {
-                        "conversation_id": f"{conversation_id}",
-                        "chat_id": f"{id}"
-                    }
-                    headers = {
-                        "Authorization": f"Bearer {API_KEY}",
-                        "Content-Type": "application/json"
-                    }
+# 是否使用 asyncio 版本的游戏引擎，开启后所有请求在界面线程的事件循环中进行
+USE_ASYNC_ENGINE = False
 
-                    response = requests.get(url, headers=headers, params=params)
-                    result = response.json()
-                    status = result['data']['status']
-                
-                # 获取消息内容
-                message_url = "https://api.coze.cn/v3/chat/message/list"
-                message_params = {
-                    "conversation_id": f"{conversation_id}",
-                    "chat_id": f"{id}"
-                }
-                message_headers = {
-                    "Authorization": f"Bearer {API_KEY}",
-                    "Content-Type": "application/json"
-                }
-                
-                response = requests.get(message_url, headers=message_headers, params=message_params)
-                result = response.json()
-                answer = result['data'][0]['content']
-                
-                self.update_player_status(agent_key, "normal", answer)
-                return answer
-            elif 'error' in result:
-                self.log(f"错误信息: {result['error']}")
-                self.update_player_status(agent_key, "error", "API错误")
-                return None
-            else:
-                self.log(f"无法获取conversation_id，响应内容: {json.dumps(result, ensure_ascii=False)}")
-                self.update_player_status(agent_key, "error", "请求失败")
-                return None
-        except Exception as e:
-            self.log(f"与智能体 {agent['name']} 通信时出错: {str(e)}")
-            self.update_player_status(agent_key, "error", str(e))
-            return None
-    
-    def initialize_game(self):
-        """初始化游戏，分配词语"""
-        self.round = 0
-        self.players_alive = list(self.agents.keys())
-        self.eliminated_players = []
-        self.game_history = []
-        
-        self.update_status("初始化游戏...")
-        
-        # 随机选择一个主题
-        self.current_theme = random.choice(self.game_themes)
-        
-        # 随机选择一个卧底
-        self.undercover = random.choice(self.players_alive)
-        
-        # 初始化所有玩家状态
-        for player in self.agents:
-            self.update_player_status(player, "normal")
-        
-        # 向玩家发送他们的词语
-        for player in self.players_alive:
-            word = self.current_theme["minority"] if player == self.undercover else self.current_theme["majority"]
-            message = f"游戏开始！你是: {self.agents[player]['name']} 你的词语是: {word}。请记住这个词语，不用给出描述"
-            response = self.send_message_to_agent(player, message)
-            
-            if response:
-                self.log(f"{self.agents[player]['name']} 已收到词语")
-            
-        self.log(f"游戏初始化完成！卧底是: {self.agents[self.undercover]['name']}")
-        self.log(f"多数派词语: {self.current_theme['majority']}")
-        self.log(f"卧底词语: {self.current_theme['minority']}")
-        
-        self.update_status("游戏已初始化")
-    
-    def play_round(self):
-        """进行一轮游戏"""
-        self.round += 1
-        self.log(f"\n====== 第 {self.round} 轮 ======")
-        self.update_status(f"第 {self.round} 轮")
-        
-        round_responses = {}
-        
-        # 每个玩家描述词语
-        for player in self.players_alive:
-            word = self.current_theme["minority"] if player == self.undercover else self.current_theme["majority"]
-            message = f"你的词语是: {word}。请根据你的词语进行一句话描述，不要直接说出这个词。"
-            description = self.send_message_to_agent(player, message)
-            
-            if description:
-                round_responses[player] = description
-                self.log(f"{self.agents[player]['name']} 描述: {description}")
-            else:
-                round_responses[player] = "无法获取有效回复"
-                self.log(f"{self.agents[player]['name']} 无法获取有效回复")
-        
-        # 记录本轮历史
-        self.game_history.append(round_responses)
-        
-        # 发送轮次完成信号
-        self.signals.round_complete.emit({
-            "round": self.round,
-            "responses": round_responses
-        })
-        
-        # 让每个玩家投票
-        votes = self.conduct_voting()
-        
-        # 处理投票结果
-        self.process_votes(votes)
-        
-        # 检查游戏是否结束
-        return self.check_game_over()
-    
-    def conduct_voting(self):
-        """进行投票"""
-        votes = {}
-        self.update_status("投票中...")
-        
-        # 构建投票信息
-        vote_info = "你是: {self.agents[player]['name']}，请不要投票给自己，请根据以下描述，投票选出你认为是卧底的玩家(输入对应数字)，但请不要投给自己:\n"
-        for i, player in enumerate(self.players_alive, 1):
-            last_description = self.game_history[-1][player]
-            vote_info += f"{i}. {self.agents[player]['name']}: {last_description}\n"
-        
-        # 收集每个玩家的投票
-        for player in self.players_alive:
-            message = vote_info
-            vote_text = self.send_message_to_agent(player, message)
-            
-            if vote_text:
-                # 尝试从回复中提取数字
-                try:
-                    # 简单处理：查找第一个数字
-                    for char in vote_text:
-                        if char.isdigit() and 1 <= int(char) <= len(self.players_alive):
-                            vote_num = int(char)
-                            voted_player = self.players_alive[vote_num - 1]
-                            votes[player] = voted_player
-                            self.log(f"{self.agents[player]['name']} 投票给了 {self.agents[voted_player]['name']}")
-                            break
-                    else:
-                        # 如果没找到有效数字，随机投票
-                        voted_player = random.choice([p for p in self.players_alive if p != player])
-                        votes[player] = voted_player
-                        self.log(f"{self.agents[player]['name']} 投票无效，系统随机分配给了 {self.agents[voted_player]['name']}")
-                except Exception as e:
-                    # 出错也随机投票
-                    self.log(f"处理投票时出错: {str(e)}")
-                    voted_player = random.choice([p for p in self.players_alive if p != player])
-                    votes[player] = voted_player
-                    self.log(f"{self.agents[player]['name']} 投票处理出错，系统随机分配给了 {self.agents[voted_player]['name']}")
-            else:
-                # 响应出错也随机投票
-                voted_player = random.choice([p for p in self.players_alive if p != player])
-                votes[player] = voted_player
-                self.log(f"{self.agents[player]['name']} 无法获取投票，系统随机分配给了 {self.agents[voted_player]['name']}")
-                
-        return votes
-    
-    def process_votes(self, votes):
-        """处理投票结果"""
-        # 统计每个玩家获得的票数
-        vote_count = {}
-        for player in self.players_alive:
-            vote_count[player] = 0
-            
-        for voter, voted in votes.items():
-            vote_count[voted] += 1
-        
-        # 找出得票最多的玩家
-        max_votes = max(vote_count.values())
-        most_voted = [player for player, count in vote_count.items() if count == max_votes]
-        
-        # 如果有平票，随机选择一个
-        eliminated = random.choice(most_voted)
-        
-        # 输出投票结果
-        self.log("\n投票结果:")
-        for player in self.players_alive:
-            self.log(f"{self.agents[player]['name']}: {vote_count[player]} 票")
-        
-        # 移除被淘汰的玩家
-        self.players_alive.remove(eliminated)
-        self.eliminated_players.append(eliminated)
-        
-        self.log(f"\n{self.agents[eliminated]['name']} 被淘汰了！")
-        is_undercover = (eliminated == self.undercover)
-        if is_undercover:
-            self.log("卧底被淘汰了！")
-        else:
-            self.log("平民被淘汰了！")
-            
-        # 发送玩家淘汰信号
-        self.signals.player_eliminated.emit(eliminated, is_undercover)
-        
-        self.update_player_status(eliminated, "eliminated")
-    
-    def check_game_over(self):
-        """检查游戏是否结束"""
-        game_over = False
-        winner = None
-        
-        # 如果卧底已被淘汰，平民获胜
-        if self.undercover in self.eliminated_players:
-            self.log("\n游戏结束！平民获胜！")
-            game_over = True
-            winner = "平民"
-        
-        # 如果只剩下卧底和一个平民，卧底获胜
-        elif len(self.players_alive) <= 2 and self.undercover in self.players_alive:
-            self.log("\n游戏结束！卧底获胜！")
-            game_over = True
-            winner = "卧底"
-        
-        if game_over:
-            # 发送游戏结束信号
-            self.signals.game_over.emit({
-                "undercover": self.agents[self.undercover]['name'],
-                "winner": winner,
-                "rounds": self.round,
-                "theme": self.current_theme
-            })
-            self.update_status(f"游戏结束 - {winner}获胜")
-            
-        return game_over
-    
-    def run_game(self):
-        """运行完整游戏"""
-        self.initialize_game()
-        
-        game_over = False
-        while not game_over:
-            game_over = self.play_round()
-            if not game_over:
-                time.sleep(2)  # 暂停几秒，便于阅读
-        
-        # 游戏结束，显示结果
-        self.log("\n====== 游戏结果 ======")
-        self.log(f"卧底是: {self.agents[self.undercover]['name']}")
-        self.log(f"卧底词语: {self.current_theme['minority']}")
-        self.log(f"多数派词语: {self.current_theme['majority']}")
-        
-        return {
-            "undercover": self.agents[self.undercover]['name'],
-            "winner": "平民" if self.undercover in self.eliminated_players else "卧底",
-            "rounds": self.round,
-            "theme": self.current_theme
-        }
+# 自动进行模式配置
+AUTO_PLAY_CONFIG = {
+    "round_pause_ms": 1500,   # 每轮结束后停留多久再进入下一轮(毫秒)，下一轮的描述请求在停留期间已经发出
+    "game_pause_ms": 3000,    # 一局结束后停留多久再开始新的一局(毫秒)
+    "restart": True           # 一局结束后是否自动开始新的一局
+}
+
+# 在 Qt 事件循环中驱动 asyncio 事件循环(与 qasync 的思路相同)
+class AsyncioBridge:
+    def __init__(self, interval=10):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.step)
+        self.timer.start(interval)
+        
+    def step(self):
+        """执行一轮已就绪的 asyncio 回调后立即把控制权交还给 Qt"""
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        
+    def submit(self, coro):
+        """在事件循环中调度一个协程"""
+        return self.loop.create_task(coro)
 
 # UI组件 - 玩家卡片
 class PlayerCard(QFrame):
@@ -424,13 +81,25 @@ class PlayerCard(QFrame):
         self.description_text.setPlaceholderText("等待描述...")
         self.description_text.setMaximumHeight(100)
         
+        # 该智能体近期的回复耗时
+        self.latency_label = QLabel("平均耗时: -")
+        self.latency_label.setAlignment(Qt.AlignCenter)
+        self.latency_label.setFont(QFont("Arial", 9))
+        
         layout.addWidget(self.name_label)
         layout.addWidget(self.status_label)
         layout.addWidget(self.description_text)
+        layout.addWidget(self.latency_label)
         
         self.setLayout(layout)
         self.setMinimumSize(200, 150)
         
+    def update_latency(self, profile):
+        if profile is None:
+            self.latency_label.setText("平均耗时: -")
+        else:
+            self.latency_label.setText(f"平均耗时: {profile['mean']:.1f}s  p90: {profile['p90']:.1f}s  ({profile['count']} 次)")
+        
     def update_status(self, status, message=""):
         self.status = status
         
@@ -443,6 +112,9 @@ class PlayerCard(QFrame):
         elif status == "thinking":
             self.status_label.setText("思考中...")
             self.setStyleSheet(f"background-color: {self.player_info['color']}; border: 2px dashed #666; border-radius: 10px;")
+            # 流式输出时实时显示已生成的部分内容
+            if message:
+                self.description_text.setText(message)
         elif status == "eliminated":
             self.status_label.setText("已淘汰")
             self.setStyleSheet("background-color: #D3D3D3; border-radius: 10px;")
@@ -460,9 +132,18 @@ class PlayerCard(QFrame):
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.game = WhoIsUndercoverGame(AGENTS, GAME_THEMES)
+        if USE_ASYNC_ENGINE:
+            self.bridge = AsyncioBridge()
+            self.game = AsyncWhoIsUndercoverGame(AGENTS, GAME_THEMES, signals=GameSignals())
+        else:
+            self.bridge = None
+            self.game = WhoIsUndercoverGame(AGENTS, GAME_THEMES, signals=GameSignals())
+        # 读取之前运行记录的各智能体耗时，用于决定并发请求的发出顺序
+        self.game.load_latency_profiles(LATENCY_PROFILE_FILE)
+        self.waiting_next_round = False  # 当前一轮已结束，等待进入下一轮
         self.setupUI()
         self.connectSignals()
+        self.updateLatencyProfiles()
         
     def setupUI(self):
         self.setWindowTitle("谁是卧底")
@@ -524,9 +205,16 @@ class MainWindow(QMainWindow):
         self.new_game_button.setMinimumHeight(40)
         self.new_game_button.setEnabled(False)
         
+        # 自动进行：不用手动点击下一轮，连续进行每一轮和每一局
+        self.auto_play_button = QPushButton("自动进行")
+        self.auto_play_button.setFont(QFont("Arial", 12))
+        self.auto_play_button.setMinimumHeight(40)
+        self.auto_play_button.setCheckable(True)
+        
         control_layout.addWidget(self.start_button)
         control_layout.addWidget(self.next_round_button)
         control_layout.addWidget(self.new_game_button)
+        control_layout.addWidget(self.auto_play_button)
         
         # 主布局
         main_layout.addLayout(top_layout)
@@ -544,11 +232,14 @@ class MainWindow(QMainWindow):
         self.game.signals.game_over.connect(self.onGameOver)
         self.game.signals.player_eliminated.connect(self.onPlayerEliminated)
         self.game.signals.update_player_status.connect(self.updatePlayerStatus)
+        self.game.signals.initialized.connect(self.onInitialized)
+        self.game.signals.round_finished.connect(self.onRoundFinished)
         
         # 连接按钮信号
         self.start_button.clicked.connect(self.startGame)
         self.next_round_button.clicked.connect(self.nextRound)
         self.new_game_button.clicked.connect(self.newGame)
+        self.auto_play_button.toggled.connect(self.toggleAutoPlay)
     
     def updateLog(self, message):
         self.log_text.append(message)
@@ -562,14 +253,70 @@ class MainWindow(QMainWindow):
         if player_key in self.player_cards:
             self.player_cards[player_key].update_status(status, message)
     
+    def toggleAutoPlay(self, checked):
+        # 自动进行时淘汰结果一出就在后台发出下一轮的描述请求
+        self.game.game_config["pipeline_rounds"] = checked
+        self.next_round_button.setEnabled(not checked and self.waiting_next_round)
+        if not checked:
+            return
+        # 当前没有进行中的操作时立即开始
+        if self.start_button.isEnabled():
+            self.startGame()
+        elif self.new_game_button.isEnabled():
+            self.restartGame()
+        elif self.waiting_next_round:
+            self.nextRound()
+    
+    def onInitialized(self, data):
+        # 所有玩家确认收到词语后才允许开始下一轮
+        self.waiting_next_round = True
+        if self.auto_play_button.isChecked():
+            QTimer.singleShot(AUTO_PLAY_CONFIG["round_pause_ms"], self.autoNextRound)
+        else:
+            self.next_round_button.setEnabled(True)
+    
     def onRoundComplete(self, data):
+        # 描述结束时投票仍在进行，下一轮按钮要等 onRoundFinished 再启用
         self.round_label.setText(f"回合: {data['round']}")
-        self.next_round_button.setEnabled(True)
+    
+    def updateLatencyProfiles(self):
+        for player_key, card in self.player_cards.items():
+            card.update_latency(self.game.latency_profile(AGENTS[player_key]["bot_id"]))
+    
+    def onRoundFinished(self, data):
+        self.updateLatencyProfiles()
+        # 自动进行时停留一段时间展示投票结果，再进入下一轮
+        if data["game_over"]:
+            return
+        self.waiting_next_round = True
+        if self.auto_play_button.isChecked():
+            QTimer.singleShot(AUTO_PLAY_CONFIG["round_pause_ms"], self.autoNextRound)
+        else:
+            self.next_round_button.setEnabled(True)
+    
+    def autoNextRound(self):
+        # 停留期间可能关闭了自动进行或已经手动进入下一轮
+        if self.auto_play_button.isChecked() and self.waiting_next_round:
+            self.nextRound()
+    
+    def restartGame(self):
+        if self.auto_play_button.isChecked() and self.new_game_button.isEnabled():
+            self.newGame()
+            self.startGame()
     
     def onGameOver(self, data):
+        self.waiting_next_round = False
         self.next_round_button.setEnabled(False)
         self.new_game_button.setEnabled(True)
         
+        # 自动进行时不弹出对话框，停留一段时间后开始新的一局
+        if self.auto_play_button.isChecked():
+            self.updateLog(f"\n{data['rounds']} 轮后{data['winner']}获胜")
+            self.revealPlayers()
+            if AUTO_PLAY_CONFIG["restart"]:
+                QTimer.singleShot(AUTO_PLAY_CONFIG["game_pause_ms"], self.restartGame)
+            return
+        
         # 显示游戏结果
         result_message = (
             f"游戏结束!\n\n"
@@ -580,7 +327,9 @@ class MainWindow(QMainWindow):
         )
         
         QMessageBox.information(self, "游戏结束", result_message)
-        
+        self.revealPlayers()
+    
+    def revealPlayers(self):
         # 揭示所有玩家身份
         for player_key in AGENTS:
             if player_key == self.game.undercover:
@@ -602,16 +351,21 @@ class MainWindow(QMainWindow):
         self.round_label.setText("回合: 0")
         
         # 在新线程中初始化游戏
-        threading.Thread(target=self.game.initialize_game, daemon=True).start()
-        
-        # 初始化完成后启用下一轮按钮
-        QTimer.singleShot(2000, lambda: self.next_round_button.setEnabled(True))
+        # 初始化完成后由 initialized 信号启用下一轮按钮
+        if self.bridge:
+            self.bridge.submit(self.game.initialize_game())
+        else:
+            threading.Thread(target=self.game.initialize_game, daemon=True).start()
     
     def nextRound(self):
+        self.waiting_next_round = False
         self.next_round_button.setEnabled(False)
         
-        # 在新线程中进行下一轮
-        threading.Thread(target=self.game.play_round, daemon=True).start()
+        # 异步引擎在事件循环中进行下一轮，否则在新线程中进行
+        if self.bridge:
+            self.bridge.submit(self.game.play_round())
+        else:
+            threading.Thread(target=self.game.play_round, daemon=True).start()
     
     def newGame(self):
         self.start_button.setEnabled(True)
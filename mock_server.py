@@ -0,0 +1,394 @@
+"""本地模拟的 Coze 接口服务，用于离线调试和压测
+
+启动: python -m mock_server --port 8080 --latency lognormal:1.5:0.4 --failure-rate 0.02
+然后设置环境变量 COZE_BASE_URL=http://127.0.0.1:8080 运行游戏或 test.py
+同时提供 OpenAI 兼容的 /v1/chat/completions 接口(model 视为 bot_id)，供 providers.OpenAICompatibleProvider 使用
+"""
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from providers import random_answer
+
+# 模拟服务默认配置
+MOCK_CONFIG = {
+    "latency": "lognormal:1.5:0.4",  # 对话完成耗时的分布
+    "failure_rate": 0.0,             # 对话以 failed 状态结束的概率
+    "error_rate": 0.0,               # 接口直接返回 HTTP 500 的概率
+    "rate_limit": 0,                 # 每个 API 密钥每秒允许的请求数，超过返回 HTTP 429，0 表示不限
+    "stream_chunks": 8,              # 流式回答拆分成的片段数
+    "answers": {},                   # bot_id -> 按顺序循环使用的脚本回答
+    "bot_latency": {}                # bot_id -> 单独的耗时分布
+}
+
+
+def parse_latency(spec):
+    """解析耗时分布，返回一个无参的采样函数
+
+    支持 fixed:秒、uniform:下限:上限、normal:均值:标准差、lognormal:中位数:sigma
+    """
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "normal":
+        return lambda: max(random.gauss(args[0], args[1]), 0.0)
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError(f"不支持的耗时分布: {spec}")
+
+
+class MockCozeState:
+    """模拟服务的全部状态：对话表、脚本回答进度和请求计数"""
+
+    def __init__(self, config=None):
+        self.config = dict(MOCK_CONFIG, **(config or {}))
+        self.latency = parse_latency(self.config["latency"])
+        self.bot_latency = {bot: parse_latency(spec) for bot, spec in self.config["bot_latency"].items()}
+        self.script_cursor = {}
+        self.chats = {}
+        self.ids = itertools.count(7000000000000000000)
+        self.requests = {}
+        self.windows = {}  # API 密钥 -> [当前一秒窗口的起点, 窗口内的请求数]
+        self.lock = threading.Lock()
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def throttle(self, api_key):
+        """按固定一秒窗口限流，超限时返回建议的等待秒数，否则返回 0"""
+        limit = self.config["rate_limit"]
+        if not limit:
+            return 0
+        now = time.time()
+        with self.lock:
+            window = self.windows.setdefault(api_key, [now, 0])
+            if now - window[0] >= 1:
+                window[0], window[1] = now, 0
+            window[1] += 1
+            if window[1] > limit:
+                self.requests["429"] = self.requests.get("429", 0) + 1
+                return window[0] + 1 - now
+        return 0
+
+    def next_id(self):
+        with self.lock:
+            return str(next(self.ids))
+
+    def answer_for(self, bot_id, message):
+        """优先按脚本回答，没有脚本时随机回答"""
+        script = self.config["answers"].get(bot_id)
+        if script:
+            with self.lock:
+                index = self.script_cursor.get(bot_id, 0)
+                self.script_cursor[bot_id] = index + 1
+            return script[index % len(script)]
+        return random_answer(message)
+
+    def create_chat(self, payload, conversation_id=None):
+        """登记一个新对话，返回对话记录"""
+        bot_id = payload.get("bot_id", "")
+        message = "".join(m.get("content", "") for m in payload.get("additional_messages", []))
+        sample = self.bot_latency.get(bot_id, self.latency)
+        now = time.time()
+        chat = {
+            "id": self.next_id(),
+            "conversation_id": conversation_id or self.next_id(),
+            "bot_id": bot_id,
+            "created_at": int(now),
+            "ready_at": now + sample(),
+            "failed": random.random() < self.config["failure_rate"],
+            "canceled": False,
+            "answer": self.answer_for(bot_id, message)
+        }
+        with self.lock:
+            self.chats[chat["id"]] = chat
+        return chat
+
+    def create_completion(self, payload):
+        """登记一次 OpenAI 兼容接口的对话补全，按最后一条用户消息回答"""
+        model = payload.get("model", "")
+        questions = [m.get("content", "") for m in payload.get("messages", []) if m.get("role") == "user"]
+        sample = self.bot_latency.get(model, self.latency)
+        return {
+            "id": f"chatcmpl-{self.next_id()}",
+            "model": model,
+            "created": int(time.time()),
+            "ready_at": time.time() + sample(),
+            "failed": random.random() < self.config["failure_rate"],
+            "answer": self.answer_for(model, questions[-1] if questions else "")
+        }
+
+    def chat_data(self, chat):
+        """对话在当前时刻的状态"""
+        data = {
+            "id": chat["id"],
+            "conversation_id": chat["conversation_id"],
+            "bot_id": chat["bot_id"],
+            "created_at": chat["created_at"],
+            "status": "in_progress"
+        }
+        if chat["canceled"]:
+            data["status"] = "canceled"
+        elif time.time() >= chat["ready_at"]:
+            if chat["failed"]:
+                data["status"] = "failed"
+                data["last_error"] = {"code": 5000, "msg": "mock failure"}
+            else:
+                data["status"] = "completed"
+                data["completed_at"] = int(chat["ready_at"])
+        return data
+
+    def cancel(self, chat):
+        """取消对话，未完成的对话之后的状态为 canceled，流式推送随即结束"""
+        if time.time() < chat["ready_at"]:
+            chat["canceled"] = True
+        return self.chat_data(chat)
+
+    def stream_events(self, chat):
+        """流式对话依次推送的全部事件 (event, data)"""
+        answer = chat["answer"]
+        pieces = max(min(self.config["stream_chunks"], len(answer)), 1)
+        size = math.ceil(len(answer) / pieces)
+        message = self.messages(chat)[0]
+        events = [("conversation.chat.created", dict(self.chat_data(chat), status="created"))]
+        # 失败的对话只推送部分内容
+        for i in range(pieces - 1 if chat["failed"] else pieces):
+            events.append(("conversation.message.delta", dict(message, content=answer[i * size:(i + 1) * size])))
+        final = dict(self.chat_data(chat), status="failed" if chat["failed"] else "completed")
+        if chat["failed"]:
+            final["last_error"] = {"code": 5000, "msg": "mock failure"}
+            events.append(("conversation.chat.failed", final))
+        else:
+            events.append(("conversation.message.completed", message))
+            events.append(("conversation.chat.completed", final))
+        events.append(("done", "\"[DONE]\""))
+        return events
+
+    def messages(self, chat):
+        """对话完成后的消息列表"""
+        base = {"chat_id": chat["id"], "conversation_id": chat["conversation_id"],
+                "bot_id": chat["bot_id"], "role": "assistant", "content_type": "text"}
+        return [
+            dict(base, id=chat["id"] + "1", type="answer", content=chat["answer"]),
+            dict(base, id=chat["id"] + "2", type="verbose", content="{\"msg_type\":\"generate_answer_finish\"}")
+        ]
+
+
+class MockCozeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockCoze/1.0"
+    # 响应头和响应体分两次写出，不关闭 Nagle 算法时每个请求会多出约 40ms 的延迟确认
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_json(self, obj, status=200, headers=None):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_event(self, event, data):
+        payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        self.send_chunk(f"event:{event}\ndata:{payload}\n\n")
+
+    def check_request(self, path):
+        """统计请求并按配置注入鉴权失败、限流和服务端错误，返回 False 表示已响应"""
+        self.state.count(path)
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer "):
+            self.send_json({"code": 4100, "msg": "authentication is invalid"})
+            return False
+        retry_after = self.state.throttle(authorization)
+        if retry_after:
+            self.send_json({"code": 4013, "msg": "request rate exceeded"}, status=429,
+                           headers={"Retry-After": str(math.ceil(retry_after))})
+            return False
+        if random.random() < self.state.config["error_rate"]:
+            self.send_json({"code": 5000, "msg": "mock internal error"}, status=500)
+            return False
+        return True
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b"{}"
+        if not self.check_request(url.path):
+            return
+        payload = json.loads(raw or b"{}")
+        if url.path == "/v3/chat/cancel":
+            chat = self.state.chats.get(payload.get("chat_id", ""))
+            if chat is None:
+                self.send_json({"code": 4200, "msg": "chat not found"})
+            else:
+                self.send_json({"code": 0, "msg": "", "data": self.state.cancel(chat)})
+            return
+        if url.path == "/v1/chat/completions":
+            self.chat_completion(self.state.create_completion(payload), payload.get("stream"))
+            return
+        if url.path != "/v3/chat":
+            self.send_json({"code": 4004, "msg": "not found"}, status=404)
+            return
+
+        conversation_id = parse_qs(url.query).get("conversation_id", [None])[0]
+        chat = self.state.create_chat(payload, conversation_id)
+        if payload.get("stream"):
+            self.stream_chat(chat)
+        else:
+            self.send_json({"code": 0, "msg": "", "data": self.state.chat_data(chat)})
+
+    def stream_chat(self, chat):
+        """以分块传输的事件流逐段推送回答，耗时均匀分摊到每个片段上"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        events = self.state.stream_events(chat)
+        pieces = sum(1 for event, _ in events if event == "conversation.message.delta") or 1
+        start = time.time()
+        total = max(chat["ready_at"] - start, 0)
+        sent = 0
+        try:
+            for event, data in events:
+                if chat["canceled"]:
+                    break
+                if event == "conversation.message.delta":
+                    sent += 1
+                    time.sleep(max(start + total * sent / pieces - time.time(), 0))
+                elif event in ("conversation.message.completed", "conversation.chat.failed"):
+                    time.sleep(max(chat["ready_at"] - time.time(), 0))
+                self.send_event(event, data)
+            if chat["canceled"]:
+                self.send_event("done", "\"[DONE]\"")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端拿到完整回答后会提前断开
+            self.close_connection = True
+
+    def chat_completion(self, completion, stream):
+        """OpenAI 兼容接口的响应：非流式等到完成后一次返回，流式逐段推送 data 事件"""
+        base = {"id": completion["id"], "model": completion["model"], "created": completion["created"]}
+        if not stream:
+            time.sleep(max(completion["ready_at"] - time.time(), 0))
+            if completion["failed"]:
+                self.send_json({"error": {"message": "mock failure", "type": "server_error"}}, status=500)
+                return
+            message = {"role": "assistant", "content": completion["answer"]}
+            self.send_json(dict(base, object="chat.completion",
+                                choices=[{"index": 0, "message": message, "finish_reason": "stop"}]))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        answer = completion["answer"]
+        pieces = max(min(self.state.config["stream_chunks"], len(answer)), 1)
+        size = math.ceil(len(answer) / pieces)
+        start = time.time()
+        total = max(completion["ready_at"] - start, 0)
+        try:
+            # 失败的对话只推送部分内容后断开
+            for i in range(pieces - 1 if completion["failed"] else pieces):
+                time.sleep(max(start + total * (i + 1) / pieces - time.time(), 0))
+                delta = {"content": answer[i * size:(i + 1) * size]}
+                chunk = dict(base, object="chat.completion.chunk",
+                             choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+                self.send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            if not completion["failed"]:
+                chunk = dict(base, object="chat.completion.chunk",
+                             choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                self.send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+                self.send_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not self.check_request(url.path):
+            return
+        query = parse_qs(url.query)
+        chat = self.state.chats.get(query.get("chat_id", [""])[0])
+        if url.path not in ("/v3/chat/retrieve", "/v3/chat/message/list"):
+            self.send_json({"code": 4004, "msg": "not found"}, status=404)
+        elif chat is None:
+            self.send_json({"code": 4200, "msg": "chat not found"})
+        elif url.path == "/v3/chat/retrieve":
+            self.send_json({"code": 0, "msg": "", "data": self.state.chat_data(chat)})
+        else:
+            self.send_json({"code": 0, "msg": "", "data": self.state.messages(chat)})
+
+
+def start_server(host="127.0.0.1", port=0, config=None, verbose=False):
+    """在后台线程启动模拟服务，返回服务对象(server.base_url 为访问地址)"""
+    server = ThreadingHTTPServer((host, port), MockCozeHandler)
+    server.daemon_threads = True
+    server.state = MockCozeState(config)
+    server.verbose = verbose
+    server.base_url = f"http://{host}:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mock_server", description="本地模拟的 Coze 接口服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", default=MOCK_CONFIG["latency"],
+                        help="耗时分布，如 fixed:1、uniform:0.5:2、normal:1.5:0.3、lognormal:1.5:0.4")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="对话失败的概率")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="接口返回 HTTP 500 的概率")
+    parser.add_argument("--rate-limit", type=int, default=0, help="每个 API 密钥每秒允许的请求数，超过返回 429")
+    parser.add_argument("--script", help="脚本文件(JSON)，可包含 answers 和 bot_latency 两项")
+    parser.add_argument("--verbose", action="store_true", help="打印每个请求")
+    args = parser.parse_args(argv)
+
+    config = {"latency": args.latency, "failure_rate": args.failure_rate, "error_rate": args.error_rate,
+              "rate_limit": args.rate_limit}
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            script = json.load(f)
+        config["answers"] = script.get("answers", {})
+        config["bot_latency"] = script.get("bot_latency", {})
+
+    server = start_server(args.host, args.port, config, args.verbose)
+    print(f"模拟 Coze 服务已启动: {server.base_url}")
+    print(f"请设置环境变量 COZE_BASE_URL={server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""智能体提供方
+
+游戏通过与 CozeClient 相同的一组方法(chat / submit_chat / cancel_chat / checkout / stats / close)
+和智能体对话。AGENTS 中的每个智能体可以用 provider 指定由谁回答:
+    "coze"                                      默认，通过 Coze 接口
+    {"type": "openai", "base_url": ..., ...}    OpenAI 兼容的 /v1/chat/completions 接口(如本地模型服务或 mock_server)
+    "scripted" 或 {"type": "scripted", ...}     进程内按规则回答，没有网络开销
+    "embedding" 或 {"type": "embedding", ...}   进程内按词向量描述和投票(需要 NumPy，见 embedding_player.py)
+"""
+import os
+import re
+import time
+import random
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from coze_client import POOL_CONFIG, CozeError, CozeTimeout, iter_sse_events, settle
+
+# 随机回答时使用的描述语料
+RANDOM_DESCRIPTIONS = [
+    "这是日常生活中很常见的东西。",
+    "很多人每天都会用到它。",
+    "它有好几种不同的类型。",
+    "小时候我就接触过它。",
+    "它和人们的休闲时间关系很大。",
+    "不同季节里它给人的感觉不一样。"
+]
+
+
+def random_answer(message):
+    """根据消息内容生成随机回答：投票请求返回一个编号，其余返回一句描述(ScriptedProvider 和 mock_server 共用)"""
+    options = re.findall(r"^(\d+)\. ", message, re.MULTILINE)
+    if "投票" in message and options:
+        return f"我投 {random.choice(options)} 号。"
+    if "不用给出描述" in message:
+        return "好的，我记住了。"
+    return random.choice(RANDOM_DESCRIPTIONS)
+
+
+class AgentProvider:
+    """提供方基类：在本地维护会话历史，子类只需实现 complete(bot_id, history, on_delta, deadline, chat)"""
+
+    stream = False
+    in_process = False  # 为 True 时 asyncio 版本直接在事件循环中调用，不放到线程池
+
+    def __init__(self, max_workers=8):
+        self.conversations = {}  # conversation_id -> [{"role": ..., "content": ...}]，新的一局开始时清空
+        self.running = set()  # 正在进行的 chat_id
+        self.canceled = set()  # 正在进行且已被取消的 chat_id
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.max_workers = max_workers
+        self._executor = None
+        self.calls = 0
+
+    def complete(self, bot_id, history, on_delta, deadline, chat):
+        """根据会话历史生成回答"""
+        raise NotImplementedError
+
+    def chat(self, bot_id, user_id, message, on_delta=None, conversation_id=None, on_created=None, deadline=None):
+        """参数同 CozeClient.chat，会话历史保存在本地，conversation_id 为空时新建会话"""
+        with self.lock:
+            self.calls += 1
+            if conversation_id is None or conversation_id not in self.conversations:
+                conversation_id = conversation_id or f"local-{next(self.ids)}"
+                self.conversations[conversation_id] = []
+            chat = {"id": f"local-{next(self.ids)}", "conversation_id": conversation_id, "bot_id": bot_id,
+                    "user_id": user_id, "created_at": int(time.time()), "status": "in_progress"}
+            history = self.conversations[conversation_id] + [{"role": "user", "content": message}]
+            self.running.add(chat["id"])
+        try:
+            if on_created:
+                on_created(chat)
+            answer = self.complete(bot_id, history, on_delta, deadline, chat)
+        finally:
+            with self.lock:
+                self.running.discard(chat["id"])
+                self.canceled.discard(chat["id"])
+        # 回答成功后才记入会话历史，失败的请求重试时不会留下半个问答；会话已被清空(上一局的请求)时不再记录
+        with self.lock:
+            if conversation_id in self.conversations:
+                self.conversations[conversation_id].extend([history[-1], {"role": "assistant", "content": answer}])
+        return answer
+
+    @property
+    def executor(self):
+        """submit_chat 使用的线程池，首次使用时创建"""
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def submit_chat(self, bot_id, user_id, message, conversation_id=None, on_created=None, deadline=None):
+        """非阻塞地发起对话，在线程池中执行 chat，返回以回答为结果的 Future"""
+        return self.executor.submit(self.chat, bot_id, user_id, message, None, conversation_id, on_created, deadline)
+
+    def cancel_chat(self, conversation_id, chat_id, bot_id=None):
+        """取消对话：正在生成的回答在下一次检查时以 CozeError 结束，已经结束的对话不受影响"""
+        with self.lock:
+            if chat_id in self.running:
+                self.canceled.add(chat_id)
+        return {"id": chat_id, "conversation_id": conversation_id, "status": "canceled"}
+
+    def check_canceled(self, chat):
+        """对话已被取消时抛出异常"""
+        with self.lock:
+            canceled = chat["id"] in self.canceled
+        if canceled:
+            raise CozeError("对话状态: canceled")
+
+    def checkout(self, bot_id, conversation_id=None, on_created=None):
+        """参数同 CozeClient.checkout"""
+        return self, bot_id, on_created, lambda error=None: None
+
+    def reset_conversations(self):
+        """丢弃保存的所有会话历史(新的一局开始时调用)"""
+        with self.lock:
+            self.conversations.clear()
+
+    def stats(self):
+        """调用次数和保存的会话数"""
+        with self.lock:
+            return {"calls": self.calls, "conversations": len(self.conversations)}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class ScriptedProvider(AgentProvider):
+    """进程内按规则回答的提供方，用于测量游戏引擎自身的开销和大批量模拟
+
+    answers 为按顺序循环使用的脚本回答；没有脚本时与 mock_server 相同：投票请求随机返回一个编号，
+    其余返回一句描述。latency 为每次回答前等待的秒数，默认不等待。
+    """
+
+    def __init__(self, answers=None, latency=0.0):
+        super().__init__()
+        self.answers = answers
+        self.latency = latency
+        self.cursor = 0
+
+    @property
+    def in_process(self):
+        # 需要等待时不能在事件循环中直接调用
+        return not self.latency
+
+    def complete(self, bot_id, history, on_delta, deadline, chat):
+        if self.latency:
+            if deadline is not None and self.latency > deadline.remaining():
+                time.sleep(max(deadline.remaining(), 0))
+                raise CozeTimeout("对话超过截止时间")
+            time.sleep(self.latency)
+        self.check_canceled(chat)
+        if self.answers:
+            with self.lock:
+                answer = self.answers[self.cursor % len(self.answers)]
+                self.cursor += 1
+        else:
+            answer = random_answer(history[-1]["content"])
+        if on_delta:
+            on_delta(answer)
+        return answer
+
+    def submit_chat(self, bot_id, user_id, message, conversation_id=None, on_created=None, deadline=None):
+        """不等待时直接在调用线程中完成，返回已完成的 Future"""
+        if self.latency:
+            return super().submit_chat(bot_id, user_id, message, conversation_id, on_created, deadline)
+        future = Future()
+        try:
+            settle(future, self.chat(bot_id, user_id, message, None, conversation_id, on_created, deadline))
+        except Exception as e:
+            settle(future, error=e)
+        return future
+
+
+class OpenAICompatibleProvider(AgentProvider):
+    """OpenAI 兼容的 /v1/chat/completions 接口
+
+    接口本身不保存会话，每次请求都带上本地保存的完整历史。model 为空时使用 bot_id 作为模型名，
+    system 为可选的系统提示词(例如 Coze 智能体的人设)。
+    """
+
+    def __init__(self, base_url, model=None, api_key=None, system=None, stream=False, pool_size=4, pool_config=None):
+        super().__init__(max_workers=pool_size)
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.system = system
+        self.stream = stream
+        self.pool_config = dict(POOL_CONFIG, **(pool_config or {}))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # 本地模型服务通常不校验密钥，但仍要求带上 Authorization 头
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key or os.getenv('OPENAI_API_KEY') or 'EMPTY'}",
+            "Content-Type": "application/json"
+        })
+
+    def complete(self, bot_id, history, on_delta, deadline, chat):
+        messages = ([{"role": "system", "content": self.system}] if self.system else []) + history
+        payload = {"model": self.model or bot_id, "messages": messages, "stream": self.stream}
+        connect, read = self.pool_config["connect_timeout"], self.pool_config["read_timeout"]
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise CozeTimeout("请求前已超过截止时间")
+            connect, read = min(connect, remaining), min(read, remaining)
+        try:
+            response = self.session.post(f"{self.base_url}/v1/chat/completions", json=payload,
+                                         timeout=(connect, read), stream=self.stream)
+        except requests.Timeout as e:
+            raise CozeTimeout(f"请求超时: {e}") from e
+        with response:
+            # 429 和 5xx 由 classify_error 按 HTTPError 的状态码归类
+            response.raise_for_status()
+            if not self.stream:
+                return response.json()["choices"][0]["message"]["content"]
+            return self.read_stream(response, on_delta, deadline, chat)
+
+    def read_stream(self, response, on_delta, deadline, chat):
+        """读取流式响应，每收到一段内容就把已生成的部分交给 on_delta"""
+        partial = ""
+        finished = False
+        try:
+            for _, data in iter_sse_events(response):
+                if deadline is not None and deadline.expired():
+                    raise CozeTimeout("流式对话超过截止时间")
+                self.check_canceled(chat)
+                if data == "[DONE]":
+                    finished = True
+                    break
+                if not isinstance(data, dict):
+                    continue
+                finished = finished or data["choices"][0].get("finish_reason") is not None
+                delta = data["choices"][0].get("delta", {}).get("content") or ""
+                if delta:
+                    partial += delta
+                    if on_delta:
+                        on_delta(partial)
+        except requests.Timeout as e:
+            raise CozeTimeout(f"读取流式响应超时: {e}") from e
+        if not finished:
+            raise CozeError("流式响应意外结束")
+        if not partial:
+            raise CozeError("流式响应中没有回答")
+        return partial
+
+    def close(self):
+        super().close()
+        self.session.close()
+
+
+# provider 类型 -> 提供方类，coze 由游戏使用的 Coze 客户端负责
+PROVIDER_TYPES = {
+    "openai": OpenAICompatibleProvider,
+    "scripted": ScriptedProvider
+}
+
+
+def provider_spec(spec):
+    """把 provider 配置统一为字典形式，"embedding" 与 {"type": "embedding"} 相同"""
+    if isinstance(spec, str):
+        spec = {"type": spec}
+    return dict(spec, type=spec.get("type", "coze"))
+
+
+def create_provider(spec, names=None):
+    """按 AGENTS 中的 provider 配置创建提供方，coze 返回 None
+
+    names 为使用该提供方的智能体 {user_id: 名字}，本地玩家投票时据此排除自己。
+    """
+    options = provider_spec(spec)
+    kind = options.pop("type")
+    if kind == "coze":
+        return None
+    if kind == "embedding":
+        # 依赖 NumPy，用到时才导入
+        from embedding_player import EmbeddingProvider
+        if names is not None:
+            options.setdefault("names", names)
+        return EmbeddingProvider(**options)
+    if kind not in PROVIDER_TYPES:
+        raise ValueError(f"不支持的智能体提供方: {kind}")
+    return PROVIDER_TYPES[kind](**options)
+
+
+def with_provider(agents, spec):
+    """返回所有智能体都改用同一提供方的 AGENTS 副本"""
+    return {key: dict(agent, provider=spec) for key, agent in agents.items()}
+
+
+def agent_providers(agents):
+    """为配置了其他提供方的智能体创建提供方，返回 {bot_id: 提供方}
+
+    请求按 bot_id 分派：共用同一个 bot 的智能体(user_id 不同)共用一个提供方，它们的 provider 配置必须相同。
+    """
+    specs = {}
+    names = {}
+    for agent in agents.values():
+        spec = provider_spec(agent.get("provider", "coze"))
+        if specs.setdefault(agent["bot_id"], spec) != spec:
+            raise ValueError(f"bot {agent['bot_id']} 被多个智能体使用，但配置了不同的提供方: "
+                             f"{specs[agent['bot_id']]} 和 {spec}")
+        names.setdefault(agent["bot_id"], {})[agent["user_id"]] = agent["name"]
+    providers = {}
+    for bot_id, spec in specs.items():
+        provider = create_provider(spec, names[bot_id])
+        if provider is not None:
+            providers[bot_id] = provider
+    return providers
+
+
+class ProviderRouter:
+    """按 bot_id 把请求分给各自的提供方，其余 bot(包括备用 bot)交给 Coze 客户端"""
+
+    def __init__(self, client, providers):
+        self.client = client
+        self.providers = providers
+
+    @property
+    def stream(self):
+        # 决定是否使用集中轮询器，以 Coze 客户端为准
+        return self.client.stream if self.client is not None else True
+
+    def provider_for(self, bot_id):
+        """该 bot 使用的提供方"""
+        provider = self.providers.get(bot_id, self.client)
+        if provider is None:
+            raise CozeError(f"bot {bot_id} 没有可用的提供方", 4000)
+        return provider
+
+    def chat(self, bot_id, user_id, message, on_delta=None, conversation_id=None, on_created=None, deadline=None):
+        return self.provider_for(bot_id).chat(bot_id, user_id, message, on_delta, conversation_id, on_created,
+                                              deadline)
+
+    def submit_chat(self, bot_id, user_id, message, conversation_id=None, on_created=None, deadline=None):
+        return self.provider_for(bot_id).submit_chat(bot_id, user_id, message, conversation_id, on_created,
+                                                     deadline)
+
+    def cancel_chat(self, conversation_id, chat_id, bot_id=None):
+        return self.provider_for(bot_id).cancel_chat(conversation_id, chat_id, bot_id)
+
+    def checkout(self, bot_id, conversation_id=None, on_created=None):
+        return self.provider_for(bot_id).checkout(bot_id, conversation_id, on_created)
+
+    def reset_conversations(self):
+        """各提供方丢弃本地保存的会话历史，Coze 客户端丢弃会话的归属记录"""
+        for provider in self.providers.values():
+            provider.reset_conversations()
+        if self.client is not None:
+            self.client.reset_conversations()
+
+    def stats(self):
+        """Coze 客户端的统计，另加各提供方的调用次数"""
+        stats = dict(self.client.stats()) if self.client is not None else {}
+        stats["providers"] = {bot_id: provider.stats() for bot_id, provider in self.providers.items()}
+        return stats
+
+    def close(self):
+        for provider in self.providers.values():
+            provider.close()
+        if self.client is not None:
+            self.client.close()